@@ -0,0 +1,237 @@
+#%% Imports.
+import sys
+import os
+import time
+import subprocess
+import tempfile
+import numpy as np
+import pandas as pd
+import logging
+import Custom_Functions as func
+
+#%% Benchmark settings.
+
+# Number of events generated for each data source, small enough to run on a laptop. Pass other sizes as arguments, e.g.
+# python Benchmark_Throw_Ins.py 1000 100000 10000000
+benchmark_scales = [1_000, 100_000]
+
+# Results of every run are added to this file so that the timings can be compared between versions of the code.
+# It is ignored by git.
+benchmark_results_path = "benchmark_results.jsonl"
+
+# Roughly how many throw-ins there are in a game, and how many events before each throw-in the Fact tables hold.
+throw_ins_per_game = 45
+look_back = 3
+
+guid_columns = ["sb_event_id", "sb_pass_assisted_shot_id", "sb_shot_key_pass_id"]
+
+
+#%% Generate synthetic SB and Opta throw-ins, shaped like the rows loaded from Fact.SB_Throw_Ins and Fact.Opta_Throw_Ins.
+
+def generate_synthetic_throw_ins(number_of_events, data_source, seed=0):
+    """
+    :param   number_of_events: Number of rows to generate.
+    :param   data_source:      String indicating if throws come from 'Statsbomb' or 'Opta'.
+    :param   seed:             Seed for the random number generator, so that every run benchmarks the same data.
+    :return: throw_ins_df:     Pandas dataframe of throw-ins, each with up to look_back events before it, in a random
+                               order as they would come from SQL. Includes columns that only hold default values.
+    """
+    rng = np.random.default_rng(seed)
+
+    # Each throw-in comes after a random number (1 to look_back) of other events.
+    block_lengths = rng.integers(2, look_back + 2, size=number_of_events // 2 + 1)
+    block_ids = np.repeat(np.arange(len(block_lengths)), block_lengths)[:number_of_events]
+    is_last_in_block = np.append(block_ids[1:] != block_ids[:-1], True)
+
+    # Split the throw-ins into games, and number the events in each game with gaps between throw-ins.
+    game_ids = block_ids // throw_ins_per_game
+    event_index = np.arange(number_of_events) + block_ids * 50
+
+    team_ids = rng.integers(1, 3, size=number_of_events)
+
+    # Some events have no known player, which SQL stores as -1.
+    player_ids = np.where(rng.random(size=number_of_events) < 0.05, -1, rng.integers(1, 500, size=number_of_events))
+
+    # Throw-ins are taken from the touchline, other events are anywhere on the pitch.
+    if data_source == "Statsbomb":
+        pass_types = rng.choice(["N/A", "Recovery", "Goal Kick", "Corner"], size=number_of_events, p=[0.7, 0.1, 0.1, 0.1])
+        throw_ins_df = pd.DataFrame({
+            "dim_game_id": game_ids,
+            "dim_team_id": team_ids,
+            "dim_player_id": player_ids,
+            "sb_event_index": event_index,
+            "sb_event_id": np.char.add(np.char.zfill(np.arange(number_of_events).astype(str), 8),
+                                       "-0000-4000-8000-000000000000"),
+            "sb_pass_type": np.where(is_last_in_block, "Throw-in", pass_types).astype(object),
+            "sb_x_coord": rng.uniform(0, 120, size=number_of_events).round(1),
+            "sb_y_coord": np.where(is_last_in_block, rng.choice([0.1, 79.9], size=number_of_events),
+                                   rng.uniform(0, 80, size=number_of_events).round(1)),
+            "sb_pass_end_x_coord": rng.uniform(0, 120, size=number_of_events).round(1),
+            "sb_pass_end_y_coord": rng.uniform(0, 80, size=number_of_events).round(1),
+            "sb_player": rng.choice([f"Player {number}" for number in range(500)], size=number_of_events).astype(object),
+            "sb_pass_assisted_shot_id": "00000000-0000-0000-0000-000000000000",
+            "sb_shot_key_pass_id": "00000000-0000-0000-0000-000000000000",
+            "sb_shot_statsbomb_xg": -1.0,
+            "sb_foul_committed_card": "N/A",
+            "sb_under_pressure": False,
+        })
+
+    elif data_source == "Opta":
+        throw_ins_df = pd.DataFrame({
+            "dim_game_id": game_ids,
+            "dim_team_id": team_ids,
+            "dim_player_id": player_ids,
+            "opta_event_index": event_index,
+            "opta_pass_throw_in": is_last_in_block,
+            "opta_x_coord": rng.uniform(0, 100, size=number_of_events).round(1),
+            "opta_y_coord": np.where(is_last_in_block, rng.choice([0.1, 99.9], size=number_of_events),
+                                     rng.uniform(0, 100, size=number_of_events).round(1)),
+            "opta_pass_end_x_coord": rng.uniform(0, 100, size=number_of_events).round(1),
+            "opta_pass_end_y_coord": rng.uniform(0, 100, size=number_of_events).round(1),
+            "opta_player": rng.choice([f"Player {number}" for number in range(500)], size=number_of_events).astype(object),
+            "opta_shot_xg": -1.0,
+            "opta_card_type": "N/A",
+            "opta_pass_cross": False,
+        })
+
+    else:
+        print("Data source does not exist. Please select either Statsbomb or Opta")
+        return
+
+    # Meta columns are loaded from SQL too, and are dropped by drop_useless_columns.
+    throw_ins_df["meta_is_current"] = True
+    throw_ins_df["meta_row_modified"] = pd.Timestamp("2024-01-01")
+
+    # Rows from SQL aren't in event order.
+    throw_ins_df = throw_ins_df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+    return throw_ins_df
+
+
+#%% Get the commit being benchmarked, so results can be compared over time.
+
+def get_git_commit():
+    """
+    :return: commit: Short hash of the current git commit. None if it can't be found.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+#%% Run the pipeline stages at each scale, and record the time and memory used by each.
+
+def main(argv=None):
+    """
+    :param argv: List of numbers of events to generate for each data source, e.g. ["1000"]. benchmark_scales is used
+                 if None or empty.
+    :return:     Prints and saves the time, CPU time, memory and row count of each stage at each scale.
+    """
+    # Only show warnings, so that the row counts logged by each function don't flood the benchmark output.
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    scales = [int(scale) for scale in argv or []] or benchmark_scales
+
+    # Start a new set of stage metrics, so that the summary only shows the stages of this benchmark.
+    func.start_stage_run()
+    git_commit = get_git_commit()
+
+    for number_of_events in scales:
+        start_time = time.perf_counter()
+        print(f"Benchmarking {number_of_events} events per data source.")
+
+        # Generating the data isn't part of the pipeline, so it isn't timed.
+        sb_throw_ins = generate_synthetic_throw_ins(number_of_events=number_of_events, data_source="Statsbomb")
+        opta_throw_ins = generate_synthetic_throw_ins(number_of_events=number_of_events, data_source="Opta")
+
+        # Every stage record holds the scale and commit as well as the time, CPU time and peak memory.
+        # The loaded throw-ins are stored with compact datatypes straight away, as in the pipeline's load stage.
+        with func.track_stage("optimise_dtypes", metrics_path=benchmark_results_path) as stage:
+            stage.update({"scale": number_of_events, "commit": git_commit})
+            sb_throw_ins = func.optimise_dtypes(df=sb_throw_ins, guid_columns=guid_columns, keep_default_values=True)
+            opta_throw_ins = func.optimise_dtypes(df=opta_throw_ins, guid_columns=guid_columns,
+                                                  keep_default_values=True)
+            stage["rows"] = len(sb_throw_ins) + len(opta_throw_ins)
+
+        # An incremental run that only touches games in one data source loads no rows from the other source.
+        empty_opta_throw_ins = opta_throw_ins.iloc[0:0]
+
+        with func.track_stage("drop_useless_columns", metrics_path=benchmark_results_path) as stage:
+            stage.update({"scale": number_of_events, "commit": git_commit})
+            sb_throw_ins = func.drop_useless_columns(df=sb_throw_ins)
+            opta_throw_ins = func.drop_useless_columns(df=opta_throw_ins)
+            stage["rows"] = len(sb_throw_ins) + len(opta_throw_ins)
+
+        with func.track_stage("extract_throw_ins_and_preceding_event", metrics_path=benchmark_results_path) as stage:
+            stage.update({"scale": number_of_events, "commit": git_commit})
+            sb_throw_ins = func.extract_throw_ins_and_preceding_event(throw_ins_df=sb_throw_ins,
+                                                                      data_source="Statsbomb", look_back=look_back)
+            opta_throw_ins = func.extract_throw_ins_and_preceding_event(throw_ins_df=opta_throw_ins,
+                                                                        data_source="Opta", look_back=look_back)
+            stage["rows"] = len(sb_throw_ins) + len(opta_throw_ins)
+
+        with func.track_stage("add_throw_in_column", metrics_path=benchmark_results_path) as stage:
+            stage.update({"scale": number_of_events, "commit": git_commit})
+            sb_throw_ins = func.add_throw_in_column(throw_ins_df=sb_throw_ins, data_source="Statsbomb")
+            opta_throw_ins = func.add_throw_in_column(throw_ins_df=opta_throw_ins, data_source="Opta")
+            stage["rows"] = len(sb_throw_ins) + len(opta_throw_ins)
+
+        with func.track_stage("merge", metrics_path=benchmark_results_path) as stage:
+            stage.update({"scale": number_of_events, "commit": git_commit})
+            throw_ins = func.merge_sb_and_opta_throw_ins(sb_throw_ins=sb_throw_ins, opta_throw_ins=opta_throw_ins,
+                                                         guid_columns=guid_columns)
+            stage["rows"] = len(throw_ins)
+
+        # Run the empty Opta rows through every stage, and merge them with the SB throw-ins, as in a single source run.
+        with func.track_stage("merge_single_source", metrics_path=benchmark_results_path) as stage:
+            stage.update({"scale": number_of_events, "commit": git_commit})
+            empty_opta_throw_ins = func.drop_useless_columns(df=empty_opta_throw_ins)
+            empty_opta_throw_ins = func.extract_throw_ins_and_preceding_event(throw_ins_df=empty_opta_throw_ins,
+                                                                              data_source="Opta", look_back=look_back)
+            empty_opta_throw_ins = func.add_throw_in_column(throw_ins_df=empty_opta_throw_ins, data_source="Opta")
+            single_source_throw_ins = func.merge_sb_and_opta_throw_ins(sb_throw_ins=sb_throw_ins,
+                                                                       opta_throw_ins=empty_opta_throw_ins,
+                                                                       guid_columns=guid_columns)
+            stage["rows"] = len(single_source_throw_ins)
+
+        # Every SB throw-in should still be in the merged table when there are no Opta throw-ins.
+        if len(single_source_throw_ins) != len(sb_throw_ins):
+            raise ValueError(f"Merging with an empty data source returned {len(single_source_throw_ins)} throw-ins "
+                             f"instead of {len(sb_throw_ins)}.")
+        del single_source_throw_ins, empty_opta_throw_ins
+
+        # The merged throw-ins are converted back to SQL datatypes before they are written.
+        with func.track_stage("restore_sql_dtypes", metrics_path=benchmark_results_path) as stage:
+            stage.update({"scale": number_of_events, "commit": git_commit})
+            throw_ins = func.restore_sql_dtypes(df=throw_ins, guid_columns=guid_columns)
+            stage["rows"] = len(throw_ins)
+
+        with func.track_stage("create_table_query", metrics_path=benchmark_results_path) as stage:
+            stage.update({"scale": number_of_events, "commit": git_commit})
+            schema_registry, _ = func.update_sql_schema_registry(schema_registry={}, df=throw_ins,
+                                                                 guid_columns=guid_columns)
+            data_types = {column: func.get_sql_column_type(entry) for column, entry in schema_registry.items()}
+            create_table_query = func.build_create_table_query(table_schema="Fact", table_name="Throw_Ins",
+                                                               data_types=data_types)
+            stage["rows"] = len(throw_ins)
+
+        with func.track_stage("sequence_store", metrics_path=benchmark_results_path) as stage, \
+                tempfile.TemporaryDirectory() as store_folder:
+            stage.update({"scale": number_of_events, "commit": git_commit})
+            func.write_throw_in_sequence_store(throw_ins_df=throw_ins, store_folder=store_folder)
+            stage["rows"] = len(throw_ins)
+
+        print(f"Benchmark of {number_of_events} events finished in "
+              f"{round((time.perf_counter() - start_time) / 60, 2)} minutes")
+
+    # Summary of the time, CPU time, memory and row count of each stage.
+    func.print_stage_summary()
+
+
+# Only run when called as a script, so that importing this module (e.g. for generate_synthetic_throw_ins) doesn't run
+# the benchmark.
+if __name__ == "__main__":
+    main(sys.argv[1:])
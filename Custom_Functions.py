@@ -1,470 +1,2780 @@
 #%% Imports
-import pyodbc
+import numpy as np
 import pandas as pd
 pd.options.mode.chained_assignment = None  # default='warn'
-from statsbombpy import sb #Statsbomb Github: https://github.com/statsbomb/statsbombpy
 import time
-import sqlalchemy
-import urllib
+import sys
+import os
+import json
+import shutil
+import hashlib
+import uuid
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import tempfile
+import logging
+from contextlib import contextmanager
+import urllib.parse
+
+# pyodbc, sqlalchemy, statsbombpy (Statsbomb Github: https://github.com/statsbomb/statsbombpy) and pyarrow are imported
+# in the functions that use them, so scripts that only use the dataframe functions don't have to load them.
+
+# Logger for messages from these functions. Scripts choose which levels are shown with logging.basicConfig.
+logger = logging.getLogger(__name__)
+
+#%% Record time, CPU time, memory and row counts for each pipeline stage.
+
+# Metrics for every stage tracked in this run, and an id so that runs can be told apart in the metrics file. Call
+# start_stage_run at the start of each run, so that a run in the same process doesn't report the stages of the last one.
+STAGE_METRICS = []
+STAGE_RUN_ID = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def start_stage_run():
+    """
+    :return: run_id: New id that the stages tracked from now on are recorded with. The metrics of earlier runs are
+                     cleared, so that print_stage_summary only shows this run.
+    """
+    global STAGE_RUN_ID
+
+    STAGE_METRICS.clear()
+
+    # A random suffix keeps the id unique for runs started in the same second.
+    STAGE_RUN_ID = f"{time.strftime('%Y-%m-%dT%H:%M:%S')}-{uuid.uuid4().hex[:8]}"
+
+    return STAGE_RUN_ID
+
+
+def get_current_rss_mb():
+    """
+    :return: rss_mb: Memory used by this process right now, in MB. None if it can't be measured.
+    """
+    # psutil works on every platform.
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 ** 2
+
+    except ImportError:
+        pass
+
+    # Without psutil, the resident pages can be read from /proc on Linux.
+    try:
+        with open("/proc/self/statm") as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def get_peak_rss_mb():
+    """
+    :return: peak_rss_mb: Highest memory used by this process since it started, in MB. None if it can't be measured.
+    """
+    # resource is only available on Linux/Mac. ru_maxrss is in KB on Linux and bytes on Mac.
+    try:
+        import resource
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak_rss / 1024 ** 2 if sys.platform == "darwin" else peak_rss / 1024
+
+    except ImportError:
+        pass
+
+    # psutil reports the peak on Windows.
+    try:
+        import psutil
+        memory_info = psutil.Process().memory_info()
+        return getattr(memory_info, "peak_wset", memory_info.rss) / 1024 ** 2
+
+    except ImportError:
+        return None
+
+
+@contextmanager
+def track_stage(stage_name, metrics_path=None):
+    """
+    :param   stage_name:   Name of the pipeline stage, e.g. "load".
+    :param   metrics_path: Path of JSON lines file that each stage's metrics are added to. Not written if None.
+    :return: stage:        Yields a dictionary for the stage. Set stage["rows"] to record the stage's row count.
+                           When the stage finishes, these are recorded:
+                           wall_seconds:         Time the stage took.
+                           cpu_seconds:          CPU time used by this process during the stage.
+                           worker_cpu_seconds:   CPU time used by worker processes that finished during the stage,
+                                                 e.g. the process pool in transform_throw_ins_in_parallel.
+                           rss_mb:               Memory used by this process at the end of the stage.
+                           rss_delta_mb:         Change in memory used by this process during the stage.
+                           process_peak_rss_mb:  Highest memory used by this process since it started, so it is the
+                                                 same for every stage after the largest one.
+    """
+    stage = {"run_id": STAGE_RUN_ID, "stage": stage_name, "rows": None}
+    start_time = time.time()
+
+    # os.times has the CPU time of the worker processes that have finished (RUSAGE_CHILDREN).
+    start_cpu_time = time.process_time()
+    start_worker_cpu_times = os.times()
+    start_rss_mb = get_current_rss_mb()
+
+    try:
+        yield stage
+
+    finally:
+        end_worker_cpu_times = os.times()
+        end_rss_mb = get_current_rss_mb()
+        stage["wall_seconds"] = round(time.time() - start_time, 3)
+        stage["cpu_seconds"] = round(time.process_time() - start_cpu_time, 3)
+        stage["worker_cpu_seconds"] = round(end_worker_cpu_times.children_user + end_worker_cpu_times.children_system -
+                                            start_worker_cpu_times.children_user -
+                                            start_worker_cpu_times.children_system, 3)
+        stage["rss_mb"] = round(end_rss_mb, 1) if end_rss_mb is not None else None
+        stage["rss_delta_mb"] = round(end_rss_mb - start_rss_mb, 1) if end_rss_mb is not None else None
+        stage["process_peak_rss_mb"] = get_peak_rss_mb()
+        STAGE_METRICS.append(stage)
+        logger.info(f"Stage {stage_name} finished in {stage['wall_seconds']} seconds ({stage['rows']} rows).")
+
+        if metrics_path is not None:
+            with open(metrics_path, "a") as metrics_file:
+                metrics_file.write(json.dumps(stage) + "\n")
+
+
+def print_stage_summary():
+    """
+    :return: Prints a table of the metrics for every stage tracked in this run.
+    """
+    if not STAGE_METRICS:
+        print("No stages have been tracked.")
+        return
+
+    summary_df = pd.DataFrame(STAGE_METRICS).drop(columns="run_id").set_index("stage")
+    print(summary_df.to_string())
+
+
+#%% Save the output of each pipeline stage as a checkpoint, so that a rerun can skip stages whose inputs haven't changed.
+
+def get_code_version(paths):
+    """
+    :param   paths:        List of paths of the code files that the pipeline stages run.
+    :return: code_version: Hash of the files, so that checkpoints made by different code aren't used.
+    """
+    code_hash = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as code_file:
+            code_hash.update(code_file.read())
+
+    return code_hash.hexdigest()[:16]
+
+
+def get_checkpoint_key(stage_name, key_parts):
+    """
+    :param   stage_name:     Name of the pipeline stage, e.g. "load".
+    :param   key_parts:      JSON serialisable settings and inputs of the stage, e.g. the checkpoint key of the stage
+                             before it and the code version. Anything that changes the stage's output must be included.
+    :return: checkpoint_key: Hash of the stage name and key parts.
+    """
+    key_str = json.dumps([stage_name, key_parts], sort_keys=True, default=str)
+
+    return hashlib.sha256(key_str.encode("utf-8")).hexdigest()[:16]
+
+
+def read_checkpoint(checkpoint_folder, stage_name, checkpoint_key):
+    """
+    :param   checkpoint_folder: Folder the checkpoints are saved in.
+    :param   stage_name:        Name of the pipeline stage.
+    :param   checkpoint_key:    Checkpoint key from get_checkpoint_key.
+    :return: outputs:           Dictionary of name -> pandas dataframe saved for the stage. None if there is no complete
+                                checkpoint with this key.
+    """
+    checkpoint_path = os.path.join(checkpoint_folder, stage_name, checkpoint_key)
+
+    # The marker file is only written once every dataframe has been saved.
+    marker_path = os.path.join(checkpoint_path, "_complete.json")
+    if not os.path.exists(marker_path):
+        return None
+
+    with open(marker_path, "r") as marker_file:
+        output_names = json.load(marker_file)["outputs"]
+
+    outputs = {name: pd.read_parquet(os.path.join(checkpoint_path, f"{name}.parquet")) for name in output_names}
+
+    return outputs
+
+
+def write_checkpoint(checkpoint_folder, stage_name, checkpoint_key, outputs):
+    """
+    :param   checkpoint_folder: Folder the checkpoints are saved in.
+    :param   stage_name:        Name of the pipeline stage.
+    :param   checkpoint_key:    Checkpoint key from get_checkpoint_key.
+    :param   outputs:           Dictionary of name -> pandas dataframe output by the stage.
+    :return: Saves each dataframe as parquet, including its index and datatypes. Older checkpoints for the stage are
+             deleted, as only the latest one can be resumed from.
+    """
+    stage_folder = os.path.join(checkpoint_folder, stage_name)
+    if os.path.exists(stage_folder):
+        shutil.rmtree(stage_folder)
+
+    checkpoint_path = os.path.join(stage_folder, checkpoint_key)
+    os.makedirs(checkpoint_path)
+
+    for name, df in outputs.items():
+        df.to_parquet(os.path.join(checkpoint_path, f"{name}.parquet"))
+
+    with open(os.path.join(checkpoint_path, "_complete.json"), "w") as marker_file:
+        json.dump({"outputs": list(outputs), "created": time.strftime("%Y-%m-%dT%H:%M:%S")}, marker_file)
+
+
+def remove_checkpoints(checkpoint_folder, stage_names):
+    """
+    :param   checkpoint_folder: Folder the checkpoints are saved in. Nothing is removed if None.
+    :param   stage_names:       Names of the stages whose checkpoints are removed.
+    :return: Removes the checkpoint of each stage. Only the folders that write_checkpoint creates are removed, so other
+             files in checkpoint_folder are kept. checkpoint_folder itself is removed if it is then empty.
+    """
+    if checkpoint_folder is None or not os.path.isdir(checkpoint_folder):
+        return
+
+    for stage_name in stage_names:
+        stage_folder = os.path.join(checkpoint_folder, stage_name)
+        if os.path.isdir(stage_folder):
+            shutil.rmtree(stage_folder)
+
+    if not os.listdir(checkpoint_folder):
+        os.rmdir(checkpoint_folder)
+
+
+def run_checkpointed_stage(stage_name, key_parts, stage_function, checkpoint_folder=None, metrics_path=None):
+    """
+    :param   stage_name:        Name of the pipeline stage, e.g. "load".
+    :param   key_parts:         Settings and inputs of the stage, see get_checkpoint_key.
+    :param   stage_function:    Function with no arguments that runs the stage and returns a dictionary of
+                                name -> pandas dataframe.
+    :param   checkpoint_folder: Folder the checkpoints are saved in. The stage always runs if None.
+    :param   metrics_path:      Path of JSON lines file that the stage's metrics are added to, see track_stage.
+    :return: outputs:           Dictionary of name -> pandas dataframe, from the checkpoint or from running the stage.
+    :return: checkpoint_key:    Checkpoint key of the stage. Include it in the key parts of the stages that use its output.
+    """
+    checkpoint_key = get_checkpoint_key(stage_name=stage_name, key_parts=key_parts)
+
+    with track_stage(stage_name, metrics_path=metrics_path) as stage:
+        outputs = None
+        if checkpoint_folder is not None:
+            outputs = read_checkpoint(checkpoint_folder=checkpoint_folder, stage_name=stage_name,
+                                      checkpoint_key=checkpoint_key)
+
+        stage["checkpoint"] = "resumed" if outputs is not None else None
+        if outputs is None:
+            outputs = stage_function()
+            if checkpoint_folder is not None:
+                write_checkpoint(checkpoint_folder=checkpoint_folder, stage_name=stage_name,
+                                 checkpoint_key=checkpoint_key, outputs=outputs)
+                stage["checkpoint"] = "saved"
+
+        else:
+            print(f"Stage {stage_name} resumed from checkpoint {checkpoint_key}.")
+
+        stage["rows"] = sum(len(df) for df in outputs.values())
+
+    return outputs, checkpoint_key
+
+
+#%% Get the SQL server connection settings.
+
+# Environment variables that the SQL server connection settings are read from.
+SQL_SETTINGS_ENVIRONMENT_VARIABLES = {"server": "STOLEN_METRES_SQL_SERVER",
+                                      "database": "STOLEN_METRES_SQL_DATABASE",
+                                      "username": "STOLEN_METRES_SQL_USERNAME"}
+
+
+def get_sql_connection_settings(server=None, database=None, username=None, config_path=None):
+    """
+    :param   server:      Name of SQL server you want to connect to.
+    :param   database:    Name of database you want to connect to.
+    :param   username:    Azure account username. Only needed for non-local connections.
+    :param   config_path: JSON file with "server", "database" and "username" keys.
+    :return: settings:    Dictionary of server, database and username. Settings that are passed in are used first,
+                          then the STOLEN_METRES_SQL_* environment variables, then the config file. Missing settings
+                          are only asked for if the script is run from a terminal.
+    """
+    config = {}
+    if config_path is not None:
+        with open(config_path, "r") as config_file:
+            config = json.load(config_file)
+
+    settings = {"server": server, "database": database, "username": username}
+    for setting, environment_variable in SQL_SETTINGS_ENVIRONMENT_VARIABLES.items():
+        if settings[setting] is None:
+            settings[setting] = os.environ.get(environment_variable) or config.get(setting)
+
+    # Username is only needed for non-local connections.
+    required_settings = ["server", "database"] + (["username"] if settings["server"] != "localhost" else [])
+    for setting in required_settings:
+        if settings[setting] is None:
+            # Scheduled jobs and worker processes can't answer a prompt, so fail instead of waiting for input.
+            if not sys.stdin or not sys.stdin.isatty():
+                raise ValueError(f"SQL {setting} has not been set. Set {SQL_SETTINGS_ENVIRONMENT_VARIABLES[setting]} "
+                                 f"or add '{setting}' to the config file.")
+            settings[setting] = input(f"Enter {setting} name:" if setting != "username" else "Enter username:")
+
+    return settings
+
+
+#%% Build the ODBC connection string, and cache Azure AD access tokens so that you only log in once per run.
+
+# pyodbc connection attribute used to pass an access token to the ODBC driver instead of logging in interactively.
+SQL_COPT_SS_ACCESS_TOKEN = 1256
+
+# Azure AD credentials and their latest access token, by username. Shared by every connection in this process.
+SQL_ACCESS_TOKEN_CACHE = {}
+SQL_ACCESS_TOKEN_LOCK = threading.Lock()
+
+
+def get_sql_odbc_connection_string(server, database, username, use_access_token=False):
+    """
+    :param   server:            Name of SQL server you want to connect to.
+    :param   database:          Name of database you want to connect to.
+    :param   username:          Azure account username. Only used for non-local connections.
+    :param   use_access_token:  Leave out the login for non-local connections, as an access token is passed instead.
+    :return: conn_string:       ODBC connection string.
+    """
+    # Connection string is different depending on if connection is local or not.
+    if server == "localhost":
+        conn_string = "Driver={ODBC Driver 18 for SQL Server}" + \
+                      ";Server=" + server + \
+                      ";Database=" + database + \
+                      ";Trusted_Connection=yes" + \
+                      ";TrustServerCertificate=yes"
+
+    else:
+        conn_string = 'DRIVER={ODBC Driver 18 for SQL Server}' \
+                      ';SERVER=tcp:' + server + \
+                      ';PORT=1433' + \
+                      ';DATABASE=' + database
+
+        # Without an access token, the ODBC driver asks you to log in for every new connection.
+        if not use_access_token:
+            conn_string += ';UID=' + username + \
+                           ';Authentication=ActiveDirectoryInteractive;'
+
+    return conn_string
+
+
+def get_sql_access_token(username):
+    """
+    :param   username:     Azure account username.
+    :return: token_struct: Azure AD access token for Azure SQL, packed in the format the ODBC driver expects.
+                           Raises ImportError if azure-identity isn't installed.
+    """
+    import struct
+    from azure.identity import InteractiveBrowserCredential
+
+    with SQL_ACCESS_TOKEN_LOCK:
+        cached = SQL_ACCESS_TOKEN_CACHE.get(username)
+
+        # Only log in again if there is no token yet, or it expires in the next 5 minutes. The credential refreshes
+        # expired tokens without asking you to log in again where it can.
+        if cached is None or cached["expires_on"] - 300 < time.time():
+            credential = cached["credential"] if cached is not None else InteractiveBrowserCredential(login_hint=username)
+            access_token = credential.get_token("https://database.windows.net/.default")
+            cached = {"credential": credential, "token": access_token.token, "expires_on": access_token.expires_on}
+            SQL_ACCESS_TOKEN_CACHE[username] = cached
+
+    # The ODBC driver expects the token as UTF-16-LE bytes, prefixed with their length.
+    token_bytes = cached["token"].encode("utf-16-le")
+    token_struct = struct.pack(f"<I{len(token_bytes)}s", len(token_bytes), token_bytes)
+
+    return token_struct
+
+
+#%% Connect to SQL server.
+
+def connect_to_sql_server(server=None, database=None, username=None, config_path=None):
+    """
+    :param   server:       Name of SQL server you want to connect to.
+    :param   database:     Name of database you want to connect to.
+    :param   username:     Azure account username.
+    :param   config_path:  JSON file with the connection settings, see get_sql_connection_settings.
+    :return: conn, cursor: Connection to server, cursor for server.
+    """
+    import pyodbc
+
+    # Server and database name, and username for non-local connections.
+    settings = get_sql_connection_settings(server=server, database=database, username=username, config_path=config_path)
+    server, database, username = settings["server"], settings["database"], settings["username"]
+
+    # Non-local connections use a cached access token if azure-identity is installed, otherwise the driver's login.
+    attrs_before = {}
+    if server != "localhost":
+        try:
+            attrs_before[SQL_COPT_SS_ACCESS_TOKEN] = get_sql_access_token(username=username)
+        except ImportError:
+            logger.warning("azure-identity is not installed, so you will be asked to log in for each connection.")
+
+    # Connection to server.
+    conn_string = get_sql_odbc_connection_string(server=server, database=database, username=username,
+                                                 use_access_token=bool(attrs_before))
+    conn = pyodbc.connect(conn_string, attrs_before=attrs_before) if attrs_before else pyodbc.connect(conn_string)
+
+    # Cursor for database.
+    cursor = conn.cursor()
+
+    return conn, cursor
+
+
+#%% Connect to SQL server using SQL alchemy.
+
+def connect_to_sql_alchemy_server(server=None, database=None, username=None, config_path=None, echo=True,
+                                  pool_size=5, max_overflow=10, pool_recycle=1800):
+    """
+        :param   server:       Name of SQL server you want to connect to.
+        :param   database:     Name of database you want to connect to.
+        :param   username:     Azure account username.
+        :param   config_path:  JSON file with the connection settings, see get_sql_connection_settings.
+        :param   echo:         Log every SQL statement. Can be changed later by setting engine.echo.
+        :param   pool_size:    Number of connections kept open in the engine's pool.
+        :param   max_overflow: Number of extra connections allowed when all pooled connections are in use.
+        :param   pool_recycle: Seconds after which pooled connections are replaced. Azure SQL closes idle connections.
+        :return: engine:       SQL alchemy engine connected to desired SQL server.
+    """
+    import sqlalchemy
+
+    # Server and database name, and username for non-local connections.
+    settings = get_sql_connection_settings(server=server, database=database, username=username, config_path=config_path)
+    server, database, username = settings["server"], settings["database"], settings["username"]
+
+    # Non-local connections use a cached access token if azure-identity is installed, otherwise the driver's login.
+    use_access_token = False
+    if server != "localhost":
+        try:
+            get_sql_access_token(username=username)
+            use_access_token = True
+        except ImportError:
+            logger.warning("azure-identity is not installed, so you will be asked to log in for each connection.")
+
+    # Connection to server/database.
+    params = urllib.parse.quote_plus(get_sql_odbc_connection_string(server=server, database=database, username=username,
+                                                                    use_access_token=use_access_token))
+    conn_string = "mssql+pyodbc:///?odbc_connect={}".format(params)
+
+    # Localhost can handle all rows being inserted at once, so fast_executemany is set to True.
+    # Foreign SQL server can't handle all rows being inserted at once, so fast_executemany is set to False.
+    # pool_pre_ping replaces connections that were dropped by the server before they are used.
+    engine = sqlalchemy.create_engine(conn_string, echo=echo, fast_executemany=server == "localhost",
+                                      pool_size=pool_size, max_overflow=max_overflow, pool_pre_ping=True,
+                                      pool_recycle=pool_recycle)
+
+    # Pass the cached access token to every new connection in the pool.
+    if use_access_token:
+        @sqlalchemy.event.listens_for(engine, "do_connect")
+        def add_access_token(dialect, connection_record, connect_args, connect_params):
+            connect_params["attrs_before"] = {SQL_COPT_SS_ACCESS_TOKEN: get_sql_access_token(username=username)}
+
+    return engine
+
+
+#%% Share one SQL alchemy engine between all reads and writes in a run.
+
+# Engines that have been created, by server, database and username.
+SQL_ENGINES = {}
+SQL_ENGINES_LOCK = threading.Lock()
+
+
+def get_sql_engine(server=None, database=None, username=None, config_path=None, echo=False, **engine_options):
+    """
+    :param   server:         Name of SQL server you want to connect to.
+    :param   database:       Name of database you want to connect to.
+    :param   username:       Azure account username.
+    :param   config_path:    JSON file with the connection settings, see get_sql_connection_settings.
+    :param   echo:           Log every SQL statement. Applied to the shared engine every time it is fetched.
+    :param   engine_options: Pool settings passed to connect_to_sql_alchemy_server the first time the engine is created.
+    :return: engine:         SQL alchemy engine shared with every other caller using the same server, database and user.
+    """
+    settings = get_sql_connection_settings(server=server, database=database, username=username, config_path=config_path)
+    engine_key = (settings["server"], settings["database"], settings["username"])
+
+    with SQL_ENGINES_LOCK:
+        if engine_key not in SQL_ENGINES:
+            SQL_ENGINES[engine_key] = connect_to_sql_alchemy_server(**settings, echo=echo, **engine_options)
+
+        engine = SQL_ENGINES[engine_key]
+
+    # Switch between quiet and verbose SQL logging.
+    engine.echo = echo
+
+    return engine
+
+
+def dispose_sql_engines():
+    """
+    :return: Closes the pooled connections of every shared engine, e.g. at the end of a run or in a new worker process.
+    """
+    with SQL_ENGINES_LOCK:
+        for engine in SQL_ENGINES.values():
+            engine.dispose()
+        SQL_ENGINES.clear()
+
+
+#%% Select table from SQL server.
+
+def select_sql_table(table_schema, table_name, connection, columns=None, filters=None, throw_in_window=None,
+                     look_back=3):
+    """
+    :param   table_schema:    Schema for table/view in SQL.
+    :param   table_name:      Name of table/view you want to load data from.
+    :param   connection:      Connection to SQL server.
+    :param   columns:         List of column names to select. All columns are selected if None.
+    :param   filters:         Dictionary of column name -> filter, see build_select_query. E.g. {"dim_game_id": (1, 500)}.
+    :param   throw_in_window: 'Statsbomb' or 'Opta' to only load the rows that extract_throw_ins_and_preceding_event
+                              would keep, filtered on the server. See build_throw_in_window_query. None loads all rows.
+    :param   look_back:       Number of events before each throw-in that the table holds. Only used with throw_in_window.
+    :return: table_df:        Pandas dataframe of table from SQL.
+    """
+    # Define SQL query.
+    if throw_in_window is None:
+        input_query, params = build_select_query(table_schema=table_schema, table_name=table_name,
+                                                 columns=columns, filters=filters)
+    else:
+        input_query, params = build_throw_in_window_query(table_schema=table_schema, table_name=table_name,
+                                                          data_source=throw_in_window, look_back=look_back,
+                                                          columns=columns, filters=filters)
+
+    # Initialise start time to see how long it takes to loop through one game.
+    start_time = time.time()
+
+    # Extract table from SQL server.
+    table_df = pd.read_sql_query(sql=input_query, con=connection, params=params or None)
+
+    # Remove the columns that were only used to filter the rows on the server.
+    if throw_in_window is not None:
+        table_df = table_df.drop(columns=[column for column in table_df.columns if column.startswith("window_")])
+
+    # Finish time of extracting the table.
+    end_time = time.time()
+
+    print(f"Table/View loaded in {(end_time - start_time) / 60} minutes.")
+
+    return table_df
+
+
+#%% Build a SELECT query with optional column projection and filters.
+
+def build_select_query(table_schema, table_name, columns=None, filters=None):
+    """
+    :param   table_schema: Schema for table/view in SQL.
+    :param   table_name:   Name of table/view you want to load data from.
+    :param   columns:      List of column names to select. All columns are selected if None.
+    :param   filters:      Dictionary of column name -> filter. A list is an IN filter, a tuple of (low, high) is a
+                           BETWEEN filter and anything else is an equals filter. E.g. {"dim_game_id": (1, 500)}.
+    :return: query:        SQL query string with ? placeholders for the filter values.
+    :return: params:       List of values for the placeholders in the query.
+    """
+    # Only select the requested columns, if any are given.
+    select_str = "*" if columns is None else ", ".join([f"[{column}]" for column in columns])
+
+    # Only current rows are ever loaded.
+    where_clauses = ["meta_is_current = 1"]
+    params = []
+
+    # Add each filter to the WHERE clause. Values are passed as parameters rather than pasted into the query.
+    for column, value in (filters or {}).items():
+        if isinstance(value, list):
+            where_clauses.append(f"[{column}] IN ({', '.join(['?'] * len(value))})")
+            params.extend(value)
+
+        elif isinstance(value, tuple) and len(value) == 2:
+            where_clauses.append(f"[{column}] BETWEEN ? AND ?")
+            params.extend(value)
+
+        else:
+            where_clauses.append(f"[{column}] = ?")
+            params.append(value)
+
+    query = f"""SELECT {select_str} FROM [{table_schema}].[{table_name}]
+                WHERE {" AND ".join(where_clauses)}"""
+
+    return query, params
+
+
+#%% Build a SELECT query that only returns throw-ins and the events kept before them, using window functions.
+
+# Event index column, column that flags throw-ins, and SQL condition that is true for throw-ins, for each data source.
+THROW_IN_WINDOW_SETTINGS = {"Statsbomb": {"event_index": "sb_event_index", "throw_in_column": "sb_pass_type",
+                                          "is_throw_in": "[sb_pass_type] = 'Throw-in'"},
+                            "Opta": {"event_index": "opta_event_index", "throw_in_column": "opta_pass_throw_in",
+                                     "is_throw_in": "[opta_pass_throw_in] = 1"}}
+
+
+def build_throw_in_window_query(table_schema, table_name, data_source, look_back=3, columns=None, filters=None):
+    """
+    :param   table_schema: Schema for table/view in SQL.
+    :param   table_name:   Name of table/view you want to load data from.
+    :param   data_source:  String indicating if throws come from 'Statsbomb' or 'Opta'.
+    :param   look_back:    Number of events before each throw-in that the table holds. Default is 3.
+    :param   columns:      List of column names to select. All columns are selected if None. The columns used by the
+                           window functions are added if they are missing.
+    :param   filters:      Dictionary of column name -> filter, see build_select_query.
+    :return: query:        SQL query string with ? placeholders for the filter values. Returns the same rows as
+                           extract_throw_ins_and_preceding_event, ordered by game and event index, along with
+                           window_ columns used for the filter.
+    :return: params:       List of values for the placeholders in the query.
+    """
+    if data_source not in THROW_IN_WINDOW_SETTINGS:
+        raise ValueError(f"Data source {data_source} does not exist. Please select either Statsbomb or Opta")
+
+    event_index = THROW_IN_WINDOW_SETTINGS[data_source]["event_index"]
+    throw_in_column = THROW_IN_WINDOW_SETTINGS[data_source]["throw_in_column"]
+    is_throw_in = f"CASE WHEN {THROW_IN_WINDOW_SETTINGS[data_source]['is_throw_in']} THEN 1 ELSE 0 END"
+
+    # The window functions need the game, event index and throw-in columns.
+    if columns is not None:
+        columns = list(columns) + [column for column in ["dim_game_id", event_index, throw_in_column]
+                                   if column not in columns]
+
+    # Filter the rows the same way as a normal select, before the window functions look at the events after each row.
+    source_query, params = build_select_query(table_schema=table_schema, table_name=table_name,
+                                              columns=columns, filters=filters)
+
+    # For every row, flag if the event k rows further on in the same game is a throw-in, for k = 1 to look_back.
+    later_columns = [f"LEAD({is_throw_in}, {k}, 0) OVER (PARTITION BY [dim_game_id] ORDER BY [{event_index}]) "
+                     f"AS window_throw_in_{k}_later" for k in range(1, look_back + 1)]
+
+    # Keep throw-ins, events directly before a throw-in, and events that aren't 2 to look_back events before one.
+    keep_conditions = ["window_is_throw_in = 1", "window_throw_in_1_later = 1"]
+    if look_back >= 2:
+        keep_conditions.append("(" + " AND ".join([f"window_throw_in_{k}_later = 0"
+                                                   for k in range(2, look_back + 1)]) + ")")
+    else:
+        keep_conditions.append("1 = 1")
+
+    query = f"""SELECT * FROM (SELECT source.*, {is_throw_in} AS window_is_throw_in, {", ".join(later_columns)}
+                               FROM ({source_query}) AS source) AS windowed
+                WHERE {" OR ".join(keep_conditions)}
+                ORDER BY [dim_game_id], [{event_index}]"""
+
+    return query, params
+
+
+#%% Select table from SQL server in chunks.
+
+def select_sql_table_in_chunks(table_schema, table_name, connection, chunk_size=100000, columns=None, filters=None):
+    """
+    :param   table_schema: Schema for table/view in SQL.
+    :param   table_name:   Name of table/view you want to load data from.
+    :param   connection:   Connection to SQL server.
+    :param   chunk_size:   Number of rows in each chunk.
+    :param   columns:      List of column names to select. All columns are selected if None.
+    :param   filters:      Dictionary of column name -> filter, see build_select_query. E.g. {"dim_game_id": (1, 500)}.
+    :return: chunk_df:     Yields pandas dataframes of at most chunk_size rows until the table has been read.
+    """
+    # Define SQL query.
+    input_query, params = build_select_query(table_schema=table_schema, table_name=table_name,
+                                             columns=columns, filters=filters)
+
+    # Initialise start time to see how long it takes to read the whole table.
+    start_time = time.time()
+    total_rows = 0
+
+    import sqlalchemy
+
+    # SQL alchemy engines need stream_results so that rows are fetched from the server as each chunk is read,
+    # rather than the whole result being buffered in memory first.
+    if isinstance(connection, sqlalchemy.engine.Engine):
+        with connection.connect().execution_options(stream_results=True) as stream_connection:
+            for chunk_df in pd.read_sql_query(sql=input_query, con=stream_connection, params=params or None,
+                                              chunksize=chunk_size):
+                total_rows += len(chunk_df)
+                yield chunk_df
+
+    else:
+        for chunk_df in pd.read_sql_query(sql=input_query, con=connection, params=params or None, chunksize=chunk_size):
+            total_rows += len(chunk_df)
+            yield chunk_df
+
+    # Finish time of extracting the table.
+    end_time = time.time()
+
+    print(f"Table/View loaded in chunks ({total_rows} rows) in {(end_time - start_time) / 60} minutes.")
+
+
+#%% Insert a dataframe into an existing SQL table in batches.
+
+def bulk_insert_dataframe(df, engine, table_schema, table_name, batch_size=50000, method="executemany",
+                          fast_executemany=None, staging_folder=None, data_source=None):
+    """
+    :param   df:               Pandas dataframe to insert. Columns must match columns in the SQL table.
+    :param   engine:           SQL alchemy engine.
+    :param   table_schema:     Schema of the existing table in SQL.
+    :param   table_name:       Name of the existing table in SQL.
+    :param   batch_size:       Maximum number of rows sent to the server in each batch.
+    :param   method:           3 choices for how rows are inserted ("executemany", "values", "bulk_insert").
+                               "executemany" sends each batch as one parameterised INSERT executed for every row.
+                               "values" sends each batch as multi-row INSERT ... VALUES statements. Each statement is
+                               capped at 1000 rows and 2100 parameters, the SQL server limits.
+                               "bulk_insert" writes each batch to a CSV file in staging_folder and loads it with BULK INSERT.
+    :param   fast_executemany: Send each "executemany" batch to the server as one array of parameters. If None, the
+                               engine's setting is used, which is only on for localhost.
+    :param   staging_folder:   Folder for "bulk_insert" CSV files. Must be readable by the SQL server, or be a path
+                               inside data_source.
+    :param   data_source:      Name of an external data source (e.g. Azure blob storage) for "bulk_insert" files.
+    :return: batch_stats:      List of dictionaries with the number of rows, seconds and rows/sec for each batch.
+                               All batches are committed together at the end, so a failed insert leaves no rows behind.
+    """
+    # Check the settings before anything is inserted.
+    if method == "bulk_insert" and staging_folder is None:
+        raise ValueError("A staging_folder is needed for the 'bulk_insert' method.")
+
+    # Foreign SQL servers can't handle all rows being inserted at once, so use the engine's setting unless told otherwise.
+    if fast_executemany is None:
+        fast_executemany = getattr(engine.dialect, "fast_executemany", False)
+
+    # Initialise start time to see how long it takes to insert all rows.
+    start_time = time.time()
+
+    columns = list(df.columns)
+    columns_str = ", ".join([f"[{column}]" for column in columns])
+    batch_stats = []
+    staging_paths = []
+
+    # SQL server allows at most 2100 parameters and 1000 rows in one INSERT ... VALUES statement.
+    rows_per_statement = max(1, min(1000, 2099 // len(columns)))
+
+    # Connection straight to the driver, so that statements aren't logged one by one by the engine.
+    raw_connection = engine.raw_connection()
+    try:
+        cursor = raw_connection.cursor()
+
+        for batch_start in range(0, len(df), batch_size):
+            batch_df = df.iloc[batch_start:batch_start + batch_size]
+            batch_start_time = time.time()
+
+            if method in ["executemany", "values"]:
+                # Convert each column to python values, with NaN values inserted as NULL.
+                column_values = [batch_df[column].astype(object).where(batch_df[column].notna(), None).tolist()
+                                 for column in columns]
+                rows = list(zip(*column_values))
+
+                if method == "executemany":
+                    cursor.fast_executemany = fast_executemany
+                    cursor.executemany(f"INSERT INTO [{table_schema}].[{table_name}] ({columns_str}) "
+                                       f"VALUES ({', '.join(['?'] * len(columns))})", rows)
+
+                else:
+                    row_placeholder = f"({', '.join(['?'] * len(columns))})"
+                    for statement_start in range(0, len(rows), rows_per_statement):
+                        statement_rows = rows[statement_start:statement_start + rows_per_statement]
+                        cursor.execute(f"INSERT INTO [{table_schema}].[{table_name}] ({columns_str}) "
+                                       f"VALUES {', '.join([row_placeholder] * len(statement_rows))}",
+                                       [value for row in statement_rows for value in row])
+
+            elif method == "bulk_insert":
+                # BIT columns need to be written as 1/0 rather than True/False.
+                batch_df = batch_df.astype({column: int for column in columns if batch_df[column].dtype == bool})
+                file_name = f"{table_schema}_{table_name}_{batch_start // batch_size}.csv"
+                staging_paths.append(os.path.join(staging_folder, file_name))
+                batch_df.to_csv(staging_paths[-1], index=False)
+
+                data_source_str = f"DATA_SOURCE = '{data_source}', " if data_source else ""
+                file_path = f"{staging_folder}/{file_name}" if data_source else os.path.join(staging_folder, file_name)
+                cursor.execute(f"BULK INSERT [{table_schema}].[{table_name}] FROM '{file_path}' "
+                               f"WITH ({data_source_str}FORMAT = 'CSV', FIRSTROW = 2, KEEPNULLS, TABLOCK)")
+
+            else:
+                raise ValueError(f"Insert method {method} does not exist. Please select 'executemany', 'values' or 'bulk_insert'.")
+
+            # Record how long the batch took to insert.
+            batch_seconds = time.time() - batch_start_time
+            rows_per_second = len(batch_df) / batch_seconds if batch_seconds > 0 else float("inf")
+            batch_stats.append({"rows": len(batch_df), "seconds": batch_seconds, "rows_per_second": rows_per_second})
+            print(f"Batch {len(batch_stats)}: {len(batch_df)} rows inserted at {rows_per_second:.0f} rows/sec.")
+
+        # Commit all batches in one transaction, so that the table never holds only part of the dataframe.
+        raw_connection.commit()
+
+    except Exception:
+        raw_connection.rollback()
+        raise
+
+    finally:
+        raw_connection.close()
+
+        # Delete the "bulk_insert" CSV files, whether or not they were loaded.
+        for staging_path in staging_paths:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+
+    # Finish time of inserting all rows.
+    end_time = time.time()
+    print(f"{len(df)} rows inserted into '{table_schema}.{table_name}' in {(end_time - start_time) / 60} minutes.")
+
+    return batch_stats
+
+
+#%% Local on-disk cache for Statsbomb data.
+
+# Folder that downloaded Statsbomb dataframes are stored in, and the size it is allowed to grow to.
+SB_CACHE_FOLDER = os.environ.get("SB_CACHE_FOLDER", os.path.join(os.path.expanduser("~"), ".statsbomb_cache"))
+SB_CACHE_MAX_SIZE_MB = 5000
+SB_CACHE_LOCK = threading.Lock()
+
+
+def SB_cache_read(cache_key, version):
+    """
+    :param   cache_key: Name of the cached dataframe, e.g. "events_3788741".
+    :param   version:   Version of the data that is wanted, e.g. the match's last_updated date. None accepts any version.
+    :return: df:        Cached dataframe, or None if it isn't cached or the cached version is out of date.
+    """
+    file_path = os.path.join(SB_CACHE_FOLDER, f"{cache_key}.parquet")
+    with SB_CACHE_LOCK:
+        cache_index = SB_cache_read_index()
+
+    # Nothing cached, or cached data has been updated by Statsbomb since it was downloaded.
+    if cache_key not in cache_index or not os.path.exists(file_path):
+        return None
+    if version is not None and cache_index[cache_key]["version"] != str(version):
+        return None
+
+    df = pd.read_parquet(file_path)
+
+    # Nested columns (lists/dicts) are stored as JSON strings, so convert them back.
+    for column in cache_index[cache_key]["json_columns"]:
+        df[column] = [json.loads(value) if isinstance(value, str) else float("nan") for value in df[column]]
+
+    # Parquet reads missing values in object columns as None, but they were NaN when downloaded.
+    for column in df.columns[df.dtypes == "object"]:
+        df[column] = df[column].where(df[column].notna(), float("nan"))
+
+    # Mark file as recently used, so it is evicted last.
+    os.utime(file_path)
+
+    return df
+
+
+def SB_cache_write(cache_key, version, df):
+    """
+    :param   cache_key: Name of the cached dataframe, e.g. "events_3788741".
+    :param   version:   Version of the data, e.g. the match's last_updated date.
+    :param   df:        Dataframe to store in the cache.
+    :return:            Dataframe is stored as parquet and the least recently used files are evicted if the cache is full.
+    """
+    os.makedirs(SB_CACHE_FOLDER, exist_ok=True)
+    df = df.copy()
+
+    # Parquet can't store columns with lists/dicts or a mix of types, so any object column that isn't only
+    # strings is stored as JSON strings.
+    json_columns = []
+    for column in df.columns[df.dtypes == "object"]:
+        values = df[column][df[column].notna()]
+        if not values.map(lambda value: isinstance(value, str)).all():
+            # Containers are checked first, as pd.notna returns an array for tuples and arrays.
+            df[column] = [json.dumps(value, default=SB_cache_convert_numpy_value)
+                          if isinstance(value, (list, dict, tuple, np.ndarray)) or pd.notna(value) else None
+                          for value in df[column]]
+            json_columns.append(column)
+
+    df.to_parquet(os.path.join(SB_CACHE_FOLDER, f"{cache_key}.parquet"), index=False)
+
+    # Only one thread at a time can update the cache index and evict files.
+    with SB_CACHE_LOCK:
+        SB_cache_update_index(cache_key=cache_key, version=version, json_columns=json_columns)
+
+
+def SB_cache_convert_numpy_value(value):
+    """
+    :param   value:      Value that json.dumps can't convert, e.g. a numpy integer or array inside a nested column.
+    :return: json_value: Python value that json.dumps can convert.
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+
+    raise TypeError(f"Object of type {type(value).__name__} can not be stored in the SB cache.")
+
+
+def SB_cache_update_index(cache_key, version, json_columns):
+    """
+    :param   cache_key:    Name of the cached dataframe that was just written.
+    :param   version:      Version of the data that was just written.
+    :param   json_columns: List of columns that were stored as JSON strings.
+    :return:               Cache index is updated and least recently used files are evicted if the cache is full.
+    """
+    # Record the version of the cached data.
+    cache_index = SB_cache_read_index()
+    cache_index[cache_key] = {"version": str(version), "json_columns": json_columns}
+
+    # Evict least recently used files until the cache is below its maximum size.
+    cached_files = [os.path.join(SB_CACHE_FOLDER, file_name) for file_name in os.listdir(SB_CACHE_FOLDER)
+                    if file_name.endswith(".parquet")]
+    cached_files.sort(key=os.path.getmtime)
+    cache_size = sum([os.path.getsize(file_path) for file_path in cached_files])
+    while cache_size > SB_CACHE_MAX_SIZE_MB * 1024 ** 2 and len(cached_files) > 1:
+        oldest_file = cached_files.pop(0)
+        cache_size -= os.path.getsize(oldest_file)
+        os.remove(oldest_file)
+        cache_index.pop(os.path.basename(oldest_file)[:-len(".parquet")], None)
+
+    with open(os.path.join(SB_CACHE_FOLDER, "cache_index.json"), "w") as index_file:
+        json.dump(cache_index, index_file)
+
+
+def SB_cache_read_index():
+    """
+    :return: cache_index: Dictionary of cache key -> version and JSON columns for every cached dataframe.
+    """
+    index_path = os.path.join(SB_CACHE_FOLDER, "cache_index.json")
+    if not os.path.exists(index_path):
+        return {}
+
+    with open(index_path) as index_file:
+        return json.load(index_file)
+
+
+#%% Load SB competitions, matches and events through the local cache.
+
+def SB_load_competitions(refresh=True):
+    """
+    :param   refresh:         Download competitions again, so that updated matches are found. Otherwise use the cache if possible.
+    :return: competitions_df: The Statsbomb free competitions dataframe.
+    """
+    competitions_df = None if refresh else SB_cache_read(cache_key="competitions", version=None)
+
+    if competitions_df is None:
+        from statsbombpy import sb
+        competitions_df = sb.competitions()
+        SB_cache_write(cache_key="competitions", version=time.time(), df=competitions_df)
+
+    return competitions_df
+
+
+def SB_load_matches(competition_id, season_id, match_updated=None):
+    """
+    :param   competition_id: SB competition id.
+    :param   season_id:      SB season id.
+    :param   match_updated:  match_updated date from the competitions dataframe. Cached matches from before this are
+                             downloaded again. None uses any cached matches.
+    :return: matches_df:     Dataframe of all matches from the competition + season.
+    """
+    cache_key = f"matches_{competition_id}_{season_id}"
+    matches_df = SB_cache_read(cache_key=cache_key, version=match_updated)
+
+    if matches_df is None:
+        from statsbombpy import sb
+        matches_df = sb.matches(competition_id=competition_id, season_id=season_id)
+        SB_cache_write(cache_key=cache_key, version=match_updated, df=matches_df)
+
+    return matches_df
+
+
+def SB_load_events(match_id, last_updated=None):
+    """
+    :param   match_id:     SB game id.
+    :param   last_updated: last_updated date from the matches dataframe. Cached events from before this are
+                           downloaded again. None uses any cached events.
+    :return: events_df:    SB events dataframe for the match.
+    """
+    cache_key = f"events_{match_id}"
+    events_df = SB_cache_read(cache_key=cache_key, version=last_updated)
+
+    if events_df is None:
+        from statsbombpy import sb
+        events_df = sb.events(match_id=match_id)
+        SB_cache_write(cache_key=cache_key, version=last_updated, df=events_df)
+
+    return events_df
+
+
+#%% Load SB events for many matches at once with a bounded pool of threads.
+
+def SB_load_events_for_matches(match_ids, last_updated_dates=None, max_workers=8, retries=3, ordered=True):
+    """
+    :param   match_ids:          List of SB game ids.
+    :param   last_updated_dates: Dictionary of game id -> last_updated date, used to download out of date cached events again.
+    :param   max_workers:        Maximum number of matches downloaded at the same time.
+    :param   retries:            Number of times a failed download is tried again before the error is raised.
+    :param   ordered:            Yield matches in the same order as match_ids. Otherwise yield each match as soon as it's loaded.
+    :return: match_id, events_df: Yields a tuple of game id and SB events dataframe for every match.
+    """
+    last_updated_dates = last_updated_dates or {}
+
+    def load_events_with_retries(match_id):
+        for attempt in range(retries + 1):
+            try:
+                return match_id, SB_load_events(match_id=match_id, last_updated=last_updated_dates.get(match_id))
+            except Exception as error:
+                if attempt == retries:
+                    raise
+                logger.warning(f"Loading events for {match_id} failed ({error}). Retrying.")
+                time.sleep(2 ** attempt)
+
+    match_ids = iter(match_ids)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Keep at most 2 loads per worker in flight, so finished events don't pile up in memory before they are used.
+        in_flight = deque()
+        for match_id in match_ids:
+            in_flight.append(executor.submit(load_events_with_retries, match_id))
+            if len(in_flight) >= 2 * max_workers:
+                break
+
+        while in_flight:
+            # Wait for the oldest load if order matters, otherwise for whichever load finishes first.
+            if ordered:
+                finished = [in_flight.popleft()]
+            else:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    in_flight.remove(future)
+
+            for future in finished:
+                # Replace each finished load with the next match id.
+                next_match_id = next(match_ids, None)
+                if next_match_id is not None:
+                    in_flight.append(executor.submit(load_events_with_retries, next_match_id))
+
+                yield future.result()
+
+
+#%% Parquet storage backend for tables.
+
+def get_parquet_filters(filters):
+    """
+    :param   filters:         Dictionary of column name -> filter, see build_select_query. E.g. {"dim_game_id": (1, 500)}.
+    :return: parquet_filters: Same filters as a list of (column, operator, value) tuples for pyarrow.
+    """
+    parquet_filters = []
+    for column, value in (filters or {}).items():
+        if isinstance(value, list):
+            parquet_filters.append((column, "in", value))
+
+        elif isinstance(value, tuple) and len(value) == 2:
+            parquet_filters.append((column, ">=", value[0]))
+            parquet_filters.append((column, "<=", value[1]))
+
+        else:
+            parquet_filters.append((column, "==", value))
+
+    return parquet_filters
+
+
+def select_parquet_table(dataset_folder, table_schema, table_name, columns=None, filters=None):
+    """
+    :param   dataset_folder: Folder containing a parquet dataset for each table, in <schema>/<table name> folders.
+    :param   table_schema:   Schema for table.
+    :param   table_name:     Name of table you want to load data from.
+    :param   columns:        List of column names to load. All columns are loaded if None.
+    :param   filters:        Dictionary of column name -> filter, see build_select_query. Filters on partition
+                             columns skip whole partitions without reading them.
+    :return: table_df:       Pandas dataframe of table, with the same current rows select_sql_table would return.
+    """
+    import pyarrow.parquet as pq
+
+    # Initialise start time to see how long it takes to load the table.
+    start_time = time.time()
+
+    dataset_path = os.path.join(dataset_folder, table_schema, table_name)
+    dataset = pq.ParquetDataset(dataset_path, partitioning="hive")
+
+    # Only load current rows, same as select_sql_table.
+    parquet_filters = get_parquet_filters(filters)
+    if "meta_is_current" in dataset.schema.names:
+        parquet_filters.append(("meta_is_current", "==", True))
+
+    # Read only the requested columns. Files are memory mapped rather than copied into memory first.
+    table_df = pq.read_table(dataset_path, columns=columns, filters=parquet_filters or None, memory_map=True,
+                             partitioning="hive").to_pandas()
+
+    # Partition columns are read as categories, so convert them back to their original datatype.
+    for column in table_df.columns[table_df.dtypes == "category"]:
+        table_df[column] = table_df[column].astype(table_df[column].cat.categories.dtype)
+        if pd.api.types.is_integer_dtype(table_df[column].dtype):
+            table_df[column] = table_df[column].astype("int64")
+
+    # Finish time of loading the table.
+    end_time = time.time()
+
+    print(f"Table {table_schema}.{table_name} loaded from parquet in {(end_time - start_time) / 60} minutes.")
+
+    return table_df
+
+
+def write_parquet_table(df, dataset_folder, table_schema, table_name, partition_columns=None, overwrite=True):
+    """
+    :param   df:                Pandas dataframe to write.
+    :param   dataset_folder:    Folder containing a parquet dataset for each table, in <schema>/<table name> folders.
+    :param   table_schema:      Schema for table.
+    :param   table_name:        Name of table you want to write.
+    :param   partition_columns: List of columns to partition the dataset by, e.g. competition and season ids.
+    :param   overwrite:         Delete the existing dataset first. Otherwise the data is added to the existing dataset.
+    :return:                    Dataframe is written as a hive partitioned parquet dataset.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    dataset_path = os.path.join(dataset_folder, table_schema, table_name)
+    if overwrite and os.path.exists(dataset_path):
+        shutil.rmtree(dataset_path)
+
+    # Unique file names, so that writing more data to the dataset doesn't overwrite files already in it.
+    ds.write_dataset(pa.Table.from_pandas(df, preserve_index=False), dataset_path, format="parquet",
+                     partitioning=partition_columns or None, partitioning_flavor="hive" if partition_columns else None,
+                     basename_template=f"part-{time.time_ns()}-{{i}}.parquet",
+                     existing_data_behavior="overwrite_or_ignore")
+    print(f"{len(df)} rows written to parquet dataset '{dataset_path}'.")
+
+
+def export_sql_table_to_parquet(table_schema, table_name, connection, dataset_folder, partition_columns=None,
+                                chunk_size=100000):
+    """
+    :param   table_schema:      Schema for table/view in SQL.
+    :param   table_name:        Name of table/view you want to export.
+    :param   connection:        Connection to SQL server.
+    :param   dataset_folder:    Folder containing a parquet dataset for each table, in <schema>/<table name> folders.
+    :param   partition_columns: List of columns to partition the dataset by, e.g. competition and season ids.
+    :param   chunk_size:        Number of rows read from SQL and written to parquet at a time.
+    :return:                    Current rows of the SQL table are written as a parquet dataset.
+    """
+    dataset_path = os.path.join(dataset_folder, table_schema, table_name)
+    if os.path.exists(dataset_path):
+        shutil.rmtree(dataset_path)
+
+    for chunk_df in select_sql_table_in_chunks(table_schema=table_schema, table_name=table_name,
+                                               connection=connection, chunk_size=chunk_size):
+        write_parquet_table(df=chunk_df, dataset_folder=dataset_folder, table_schema=table_schema,
+                            table_name=table_name, partition_columns=partition_columns, overwrite=False)
+
+
+#%% Registry of SQL column types for a table.
+
+# Numeric SQL datatypes, from narrowest to widest. A column can always be widened to a later type.
+SQL_NUMERIC_TYPE_ORDER = ["BIT", "INT", "FLOAT"]
+
+# Longest string that a value of each SQL datatype converts to, for when a column is widened to NVARCHAR.
+SQL_TYPE_STRING_LENGTHS = {"BIT": 1, "INT": 11, "FLOAT": 30, "DATETIME2": 27, "UNIQUEIDENTIFIER": 36}
+
+
+def get_widened_sql_type(column, registry_type, new_type):
+    """
+    :param   column:        Name of the column, for the error message.
+    :param   registry_type: SQL datatype the column has in the registry, e.g. "INT".
+    :param   new_type:      SQL datatype that the new data needs, e.g. "FLOAT".
+    :return: widened_type:  SQL datatype that holds both the existing and the new data.
+    """
+    # Strings hold anything. Datatypes that weren't created by this registry (e.g. read from an existing table) are kept.
+    if registry_type == new_type or registry_type == "NVARCHAR" or \
+            registry_type not in SQL_NUMERIC_TYPE_ORDER + list(SQL_TYPE_STRING_LENGTHS):
+        return registry_type
+
+    # Numbers are widened to the wider numeric type, e.g. INT -> FLOAT.
+    if registry_type in SQL_NUMERIC_TYPE_ORDER and new_type in SQL_NUMERIC_TYPE_ORDER:
+        return max(registry_type, new_type, key=SQL_NUMERIC_TYPE_ORDER.index)
+
+    # Any other datatype can be converted to strings.
+    if new_type == "NVARCHAR":
+        return "NVARCHAR"
+
+    raise ValueError(f"Column {column} can not be changed from {registry_type} to {new_type} without losing data.")
+
+
+def update_sql_schema_registry(schema_registry, df, guid_columns):
+    """
+    :param   schema_registry: Dictionary of column name -> {"sql_type", "max_length", "guid"}. Can be empty.
+    :param   df:              Pandas dataframe of new data for the table.
+    :param   guid_columns:    List of columns that are GUIDs. Need to specify these as they appear as objects/strings.
+    :return: schema_registry: Updated registry. Datatypes and NVARCHAR lengths only ever widen.
+    :return: changed_columns: List of columns that are new to the registry, or have been widened.
+    """
+    changed_columns = []
+
+    # Loop through each column name and find the SQL datatype it needs. Datatypes are checked by kind rather than by
+    # name, so that e.g. the str datatype that newer pandas versions load strings as, or int32 columns, are handled.
+    for column in df.columns:
+        # Find data type of column being looped through.
+        data_type = df[column].dtype
+        max_length = None
+
+        # If data type is a bool, then data type in SQL needs to be a BIT. Checked first, as bools also count as numbers.
+        if pd.api.types.is_bool_dtype(data_type):
+            sql_type = "BIT"
+
+        # If data type is a GUID, then data type in SQL needs to be a UNIQUEIDENTIFIER.
+        elif pd.api.types.is_string_dtype(data_type) and column in guid_columns:
+            sql_type = "UNIQUEIDENTIFIER"
+
+        # If data type is a string and not a GUID, then data type in SQL needs to be a NVARCHAR().
+        # Lengths are only measured for unique values, as most string columns repeat a small number of values.
+        elif pd.api.types.is_string_dtype(data_type):
+            sql_type = "NVARCHAR"
+            unique_values = pd.Series(pd.unique(df[column]), dtype=object)
+            max_length = max(int(unique_values.astype(str).str.len().max()) if len(unique_values) > 0 else 1, 1)
+
+        # If data type is a float, then data type in SQL needs to be a FLOAT.
+        elif pd.api.types.is_float_dtype(data_type):
+            sql_type = "FLOAT"
+
+        # If data type is an integer, then data type in SQL needs to be an INT.
+        elif pd.api.types.is_integer_dtype(data_type):
+            sql_type = "INT"
+
+        # If data type is a date, then data type in SQL needs to be a DATETIME2.
+        elif pd.api.types.is_datetime64_any_dtype(data_type):
+            sql_type = "DATETIME2"
+
+        # Raise error if one of the columns has a weird datatype.
+        else:
+            raise ValueError(f"Column {column} has a datatype that has not been configured. Datetype = {data_type}")
+
+        # Add new columns.
+        if column not in schema_registry:
+            schema_registry[column] = {"sql_type": sql_type, "max_length": max_length, "guid": column in guid_columns}
+            changed_columns.append(column)
+            continue
+
+        # Widen columns that now hold a wider datatype, e.g. an INT column that now holds floats.
+        registry_type = schema_registry[column]["sql_type"]
+        widened_type = get_widened_sql_type(column=column, registry_type=registry_type, new_type=sql_type)
+        if widened_type != registry_type:
+            # Strings need to be long enough for the values already in the column as well as the new ones.
+            if widened_type == "NVARCHAR":
+                max_length = max(max_length or 1, SQL_TYPE_STRING_LENGTHS[registry_type])
+
+            schema_registry[column] = {"sql_type": widened_type, "max_length": max_length,
+                                       "guid": schema_registry[column]["guid"] and widened_type == "UNIQUEIDENTIFIER"}
+            changed_columns.append(column)
+
+        # Only let string columns grow.
+        elif max_length is not None and max_length > (schema_registry[column]["max_length"] or 0):
+            schema_registry[column]["max_length"] = max_length
+            changed_columns.append(column)
+
+    return schema_registry, changed_columns
+
+
+def get_sql_column_type(column_entry):
+    """
+    :param   column_entry: Entry for one column in a schema registry.
+    :return: sql_type:     SQL datatype for the column, e.g. NVARCHAR(25).
+    """
+    if column_entry["sql_type"] == "NVARCHAR":
+        return f"NVARCHAR({column_entry['max_length']})"
+
+    return column_entry["sql_type"]
+
+
+def get_sql_default_value(column_entry):
+    """
+    :param   column_entry:  Entry for one column in a schema registry.
+    :return: default_value: SQL literal for the value used when there is no data. None for dates.
+    """
+    default_values = {"NVARCHAR": "'N/A'", "UNIQUEIDENTIFIER": "'00000000-0000-0000-0000-000000000000'",
+                      "FLOAT": "-1", "INT": "-1", "BIT": "0", "DATETIME2": None}
+
+    return default_values[column_entry["sql_type"]]
+
+
+def get_sql_schema_registry_from_table(engine, table_schema, table_name):
+    """
+    :param   engine:          SQL alchemy engine.
+    :param   table_schema:    Schema of the existing table in SQL.
+    :param   table_name:      Name of the existing table in SQL.
+    :return: schema_registry: Registry of the table's current columns, apart from the meta columns filled in by SQL defaults.
+    """
+    columns_df = pd.read_sql_query(sql=f"""SELECT COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH
+                                           FROM INFORMATION_SCHEMA.COLUMNS
+                                           WHERE TABLE_SCHEMA = '{table_schema}' AND TABLE_NAME = '{table_name}'
+                                           AND COLUMN_NAME NOT IN ('meta_row_modified', 'meta_valid_from', 'meta_valid_to')""",
+                                   con=engine)
+
+    schema_registry = {}
+    for column, data_type, max_length in zip(columns_df["COLUMN_NAME"], columns_df["DATA_TYPE"],
+                                             columns_df["CHARACTER_MAXIMUM_LENGTH"]):
+        schema_registry[column] = {"sql_type": data_type.upper(),
+                                   "max_length": int(max_length) if data_type.upper() == "NVARCHAR" else None,
+                                   "guid": data_type.upper() == "UNIQUEIDENTIFIER"}
+
+    return schema_registry
+
+
+def build_create_table_query(table_schema, table_name, data_types):
+    """
+    :param   table_schema:       Schema of table you want to create in SQL.
+    :param   table_name:         Name of table you want to create in SQL.
+    :param   data_types:         Dictionary of column name -> SQL datatype, e.g. from get_sql_column_type.
+    :return: create_table_query: SQL query that creates the table with the columns, along with meta columns.
+    """
+    # Create a string representing column names and data types for SQL.
+    sql_columns_str = ', '.join([f"{col} {col_type}" for col, col_type in data_types.items()])
+
+    # Create the SQL table with specified columns and data types, along with meta columns.
+    create_table_query = f"CREATE TABLE {table_schema}.{table_name} ({sql_columns_str}," \
+                         f"meta_row_modified DATETIME2, " \
+                         f"meta_valid_from DATETIME2, " \
+                         f"meta_valid_to DATETIME2) " \
+                         f"ALTER TABLE {table_schema}.{table_name} ADD  DEFAULT (getdate()) FOR [meta_row_modified] " \
+                         f"ALTER TABLE {table_schema}.{table_name} ADD  DEFAULT (getdate()) FOR [meta_valid_from] " \
+                         f"ALTER TABLE {table_schema}.{table_name} ADD  DEFAULT ('9999-01-01') FOR [meta_valid_to] "
+
+    return create_table_query
+
+
+def build_drop_default_constraint_query(table, column):
+    """
+    :param   table:                          Table in SQL, including its schema, e.g. "Fact.Throw_Ins".
+    :param   column:                         Name of the column.
+    :return: drop_default_constraint_query: SQL query that drops the default constraint bound to the column, if it has
+                                            one. SQL server can't ALTER COLUMN while a default is bound to it.
+    """
+    # Default constraints get generated names, so the name is looked up and dropped with dynamic SQL.
+    drop_default_constraint_query = f"DECLARE @constraint_name NVARCHAR(256) = (SELECT name FROM sys.default_constraints " \
+                                    f"WHERE parent_object_id = OBJECT_ID('{table}') " \
+                                    f"AND parent_column_id = COLUMNPROPERTY(OBJECT_ID('{table}'), '{column}', 'ColumnId')) " \
+                                    f"IF @constraint_name IS NOT NULL " \
+                                    f"EXEC('ALTER TABLE {table} DROP CONSTRAINT [' + @constraint_name + ']')"
+
+    return drop_default_constraint_query
+
+
+def load_sql_schema_registry(registry_path):
+    """
+    :param   registry_path:   Path of JSON file the registry is saved in.
+    :return: schema_registry: Saved registry, or None if it hasn't been saved yet.
+    """
+    if not os.path.exists(registry_path):
+        return None
+
+    with open(registry_path) as registry_file:
+        return json.load(registry_file)
+
+
+def save_sql_schema_registry(schema_registry, registry_path):
+    """
+    :param   schema_registry: Registry of column name -> {"sql_type", "max_length", "guid"}.
+    :param   registry_path:   Path of JSON file the registry is saved in.
+    :return:                  Registry is saved as JSON.
+    """
+    with open(registry_path, "w") as registry_file:
+        json.dump(schema_registry, registry_file, indent=4)
+
+
+# %% Load in a certain season from a certain league.
+
+def SB_load_matches_from_season(league_name, season_name):
+    """
+    :param   league_name: Name of the league that you want data from (str) E.g. Premier League
+    :param   season_name: Name of the season that you want data from (str) E.g. 2003/2004
+    :return: matches_df:  Dataframe of all matches from selected season of selected league.
+    """
+
+    # The competitions that have Statsbomb data available.
+    competitions_df = SB_load_competitions()
+
+    # Extract SB competition id for desired competition.
+    comp_id = competitions_df['competition_id'][
+        (competitions_df['competition_name'] == league_name) & (competitions_df['season_name'] == season_name)].array[0]
+
+    # Extract SB season id for desired season.
+    seas_id = competitions_df['season_id'][
+        (competitions_df['competition_name'] == league_name) & (competitions_df['season_name'] == season_name)].array[0]
+
+    # Extract date the matches were last updated, so that out of date cached matches are downloaded again.
+    match_updated = competitions_df['match_updated'][
+        (competitions_df['competition_name'] == league_name) & (competitions_df['season_name'] == season_name)].array[0]
+
+    # Return the matches for the desired competition.
+    matches_df = SB_load_matches(competition_id=comp_id, season_id=seas_id,
+                                 match_updated=match_updated).sort_values(by='match_date')
+
+    return matches_df
+
+
+#%% Get all unique SB competition + season ids.
+
+def SB_get_unique_competitions(sb_competitions_df):
+    """
+    :param  sb_competitions_df: The Statsbomb free competitions dataframe.
+    :return comp_season_ids:    List of tuples containing all unique SB competition + season ids.
+    """
+    # Get a list of all unique competition + season ids in SB data, in the order they first appear.
+    comp_season_ids = list(sb_competitions_df[["competition_id", "season_id"]].drop_duplicates()
+                           .itertuples(index=False, name=None))
+
+    return comp_season_ids
+
+
+#%% Get dataframe with all unique SB game ids, competition ids, season ids and modified dates.
+
+def SB_get_unique_games_df(comp_season_ids, sb_competitions_df=None):
+    """
+    :param   comp_season_ids:    List of tuples containing all unique SB competition + season ids.
+    :param   sb_competitions_df: The Statsbomb free competitions dataframe. If given, its match_updated dates are used
+                                 to download cached matches again when they are out of date.
+    :return: sb_games_df:        Dataframe of unique SB games with columns match_id, competition_id, season_id and
+                                 last_updated, in the order the games first appear.
+    """
+    # Dates that the matches for each competition + season were last updated.
+    match_updated_dates = {}
+    if sb_competitions_df is not None:
+        match_updated_dates = dict(zip(zip(sb_competitions_df.competition_id, sb_competitions_df.season_id),
+                                       sb_competitions_df.match_updated))
+
+    # Get a list of dataframes with the SB game ids, competition ids, season ids and modified date.
+    game_dfs = []
+    for comp_season_id in comp_season_ids:
+        # Extract dataframe of games from specified competition + season.
+        # Added try/except as one competition is not giving a dataframe on SB side.
+        try:
+            game_df = SB_load_matches(competition_id=comp_season_id[0], season_id=comp_season_id[1],
+                                      match_updated=match_updated_dates.get(comp_season_id))
+            game_dfs.append(pd.DataFrame({"match_id": game_df.match_id.to_numpy(),
+                                          "competition_id": comp_season_id[0],
+                                          "season_id": comp_season_id[1],
+                                          "last_updated": pd.to_datetime(game_df.last_updated).to_numpy()}))
+
+        except AttributeError:
+            print(f"comp_id = {comp_season_id[0]}, season_id = {comp_season_id[1]} match dataframe does not exist.")
+
+    if not game_dfs:
+        return pd.DataFrame(columns=["match_id", "competition_id", "season_id", "last_updated"])
+
+    # Only keep the first time each game appears.
+    sb_games_df = pd.concat(game_dfs, ignore_index=True).drop_duplicates(subset="match_id").reset_index(drop=True)
+
+    return sb_games_df
+
+
+#%% Get tuples with all unique SB game ids, competition ids, season ids and modified dates.
+
+def SB_get_unique_games(comp_season_ids, sb_competitions_df=None, sb_games_df=None):
+    """
+    :param   comp_season_ids:    List of tuples containing all unique SB competition + season ids.
+    :param   sb_competitions_df: The Statsbomb free competitions dataframe. If given, its match_updated dates are used
+                                 to download cached matches again when they are out of date.
+    :param   sb_games_df:        Dataframe from SB_get_unique_games_df. If given, games aren't loaded again.
+    :return: sb_game_tuples:     List of tuples containing unique SB game ids, competition ids, season ids, and modified dates.
+    :return: sb_game_ids:        List of all unique SB game ids.
+    """
+    if sb_games_df is None:
+        sb_games_df = SB_get_unique_games_df(comp_season_ids=comp_season_ids, sb_competitions_df=sb_competitions_df)
+
+    # Get a list of tuples that include all the SB game ids, competition ids, season ids and modified date.
+    sb_game_tuples = list(zip(sb_games_df.match_id, sb_games_df.competition_id, sb_games_df.season_id,
+                              sb_games_df.last_updated))
+    sb_game_ids = sb_games_df.match_id.tolist()
+
+    return sb_game_tuples, sb_game_ids
+
+
+#%% Get all unique SB event ids.
+
+def SB_get_unique_events(sb_game_ids, sb_game_tuples=None, sb_events_df=None):
+    """
+    :param   sb_game_ids:    List containing all SB game ids.
+    :param   sb_game_tuples: List of tuples from SB_get_unique_games. If given, the modified dates are used to
+                             download cached events again when they are out of date.
+    :param   sb_events_df:   Dataframe of already loaded SB events. If given, events aren't loaded again.
+    :return: unique_events:  List of all unique event ids for all SB event data.
+    """
+    # Event ids from already loaded events, in the order they first appear.
+    if sb_events_df is not None:
+        return sb_events_df["id"].drop_duplicates().tolist()
+
+    # Dates that each game was last updated.
+    last_updated_dates = {game_tuple[0]: game_tuple[3] for game_tuple in sb_game_tuples or []}
+
+    # Initialise dictionary that will contain all unique SB event ids. Dictionary keys keep the order they were added in.
+    unique_events = {}
+
+    # Loop through the events of all SB unique game ids.
+    for game_id, events_df in SB_load_events_for_matches(match_ids=sb_game_ids, last_updated_dates=last_updated_dates):
+        # Add all unique event ids.
+        unique_events.update(dict.fromkeys(events_df["id"]))
+
+    return list(unique_events)
+
+
+#%% Extract value from SB event column.
+
+def SB_extract_event_column_value(events_df, event_row, column_name, column_type):
+    """
+    :param:  events_df:   SB events dataframe for a specific match.
+    :param:  event_row:   The row number for the event.
+    :param:  column_name: Name of the column in the events_df.
+    :param:  column_type: 7 choices for what column type the value is coming from ("T/F", "id", "str", "int", "float", "coords", "coords_z")
+    :return: value:       Desired value from a specified column and row from event dataframe.
+    """
+    # Not all columns exist in every SB event dataframe, so KeyErrors occur when you attempt to use a column that
+    # isn't present in the specified event dataframe.
+    # If column type is True/False, we want values that don't exist to return 0, there are no 'False' entries in SB data, just nan.
+    if column_type == "T/F":
+        try:
+            value = str(events_df.loc[event_row, column_name])
+            if value == "nan":
+                value = 0
+            elif value == "True":
+                value = 1
+        except KeyError:
+            value = 0
+
+    # If column type is GUID id, we want values that don't exist to return None.
+    elif column_type == "id":
+        try:
+            value = str(events_df.loc[event_row, column_name])
+            if value == "nan":
+                value = None
+        except KeyError:
+            value = None
+
+    # If column type is a string, we want values that don't exist to return N/A.
+    elif column_type == "str":
+        try:
+            value = str(events_df.loc[event_row, column_name])
+            if value == "nan":
+                value = "N/A"
+        except KeyError:
+            value = "N/A"
+
+    # If column type is a float, we want values that don't exist to return 9999.
+    elif column_type == "int":
+        try:
+            value = events_df.loc[event_row, column_name]
+            if str(value) == "nan":
+                value = -1 # Changed 14/01/24: Previously was 999999
+            else:
+                value = int(value)
+        except KeyError:
+            value = -1 # Changed 14/01/24: Previously was 999999
+
+    # If column type is a float, we want values that don't exist to return 9999.
+    elif column_type == "float":
+        try:
+            value = events_df.loc[event_row, column_name]
+            if str(value) == "nan":
+                value = -1 # Changed 14/01/24: Previously was 999999
+            else:
+                value = float(value)
+        except KeyError:
+            value = -1 # Changed 14/01/24: Previously was 999999
+
+    # If column type is x and y coordinates, we want values that don't exist to return (9999, 9999).
+    elif column_type == "coords":
+        try:
+            value = events_df.loc[event_row, column_name]
+            if str(value) == "nan":
+                value = (-1, -1) # Changed 14/01/24: Previously was (999999, 999999)
+            else:
+                value = (value[0], value[1])
+        except KeyError:
+            value = (-1, -1) # Changed 14/01/24: Previously was (999999, 999999)
+
+    # If column type is x, y, z coordinates, we want values that don't exist to return (-1, -1, -1).
+    # This is for shot end location qualifier, if shot is on target, z coord is included, not included otherwise.
+    elif column_type == "coords_z":
+        try:
+            value = events_df.loc[event_row, column_name]
+            if str(value) == "nan":
+                value = (-1, -1, -1) # Changed 14/01/24: Previously was (999999, 999999, 999999)
+            elif len(value) == 2:
+                value = (value[0], value[1], -1) # Changed 14/01/24: Previously was (..., ..., 999999)
+            else:
+                value = (value[0], value[1], value[2])
+        except KeyError:
+            value = (-1, -1, -1) # Changed 14/01/24: Previously was (999999, 999999, 999999)
+
+    else:
+        print(f"Column type {column_type} is incorrect for {column_name}.")
+
+    return value
+
+
+#%% Extract and normalise many SB event columns at once.
+
+def SB_extract_event_columns(events_df, column_types):
+    """
+    :param:  events_df:    SB events dataframe for one or more matches.
+    :param:  column_types: Dictionary of column name -> column type. Same 7 choices as SB_extract_event_column_value
+                           ("T/F", "id", "str", "int", "float", "coords", "coords_z").
+    :return: extracted_df: Dataframe with the same defaults for missing values as SB_extract_event_column_value.
+                           "coords" columns are split into <column>_x and <column>_y columns, and "coords_z" columns
+                           into <column>_x, <column>_y and <column>_z columns.
+    """
+    # Columns that are added to the extracted dataframe.
+    extracted_columns = {}
+
+    for column_name, column_type in column_types.items():
+        # Not all columns exist in every SB event dataframe. Missing columns are treated as if every value is missing.
+        if column_name in events_df.columns:
+            values = events_df[column_name]
+        else:
+            values = pd.Series(float("nan"), index=events_df.index, dtype=object)
+        is_missing = values.isna()
+
+        # True/False values that don't exist return 0, there are no 'False' entries in SB data, just nan.
+        if column_type == "T/F":
+            if values.eq(True).where(~is_missing, True).all():
+                extracted_columns[column_name] = (~is_missing).astype(int)
+            else:
+                extracted = values.astype(str).where(~is_missing, 0)
+                extracted_columns[column_name] = extracted.where(~values.eq(True), 1)
+
+        # GUID ids that don't exist return None.
+        elif column_type == "id":
+            extracted_columns[column_name] = values.astype(str).astype(object).where(~is_missing, None)
+
+        # Strings that don't exist return N/A.
+        elif column_type == "str":
+            extracted_columns[column_name] = values.astype(str).where(~is_missing, "N/A")
+
+        # Integers that don't exist return -1.
+        elif column_type == "int":
+            extracted_columns[column_name] = pd.to_numeric(values.where(~is_missing, -1)).astype("int64")
+
+        # Floats that don't exist return -1.
+        elif column_type == "float":
+            extracted_columns[column_name] = pd.to_numeric(values.where(~is_missing, -1)).astype("float64")
+
+        # Coordinates that don't exist return -1 for every axis. If a shot end location has no z coordinate, z is -1.
+        elif column_type in ["coords", "coords_z"]:
+            axes = ["x", "y"] if column_type == "coords" else ["x", "y", "z"]
+            coords_df = pd.DataFrame(values[~is_missing].tolist(), index=values.index[~is_missing])
+            coords_df = coords_df.reindex(index=values.index, columns=range(len(axes))).fillna(-1)
+            for axis_number, axis in enumerate(axes):
+                extracted_columns[f"{column_name}_{axis}"] = coords_df[axis_number]
+
+        else:
+            raise ValueError(f"Column type {column_type} is incorrect for {column_name}.")
+
+    extracted_df = pd.DataFrame(extracted_columns, index=events_df.index)
+
+    return extracted_df
+
+
+#%% Profile the schema of all SB event data in one pass.
+
+def SB_profile_event_schema(schema_path=None):
+    """
+    :param   schema_path:     Path of JSON file the schema is written to. Not written if None.
+    :return: sb_event_schema: Dictionary with the total number of rows and matches, and for every column (in the order
+                              they first appear) its inferred dtype, null count, null rate and maximum string length.
+                              Maximum string length is only calculated for object (string/list/dict) columns.
+    """
+    # Load in Statsbomb (SB) competition data.
+    sb_competitions = SB_load_competitions()
+
+    # Get a list of all unique competition + season ids in SB data.
+    comp_season_ids = SB_get_unique_competitions(sb_competitions_df=sb_competitions)
+
+    # Get a list of tuples that include all the SB game ids, competition ids, season ids and modified date.
+    sb_game_tuples, sb_game_ids = SB_get_unique_games(comp_season_ids=comp_season_ids,
+                                                      sb_competitions_df=sb_competitions)
+
+    # Initiate dictionary of column profiles. Dictionary keys keep the order they were added in.
+    column_profiles = {}
+    total_rows = 0
+
+    # Loop through each game id and inspect its events.
+    last_updated_dates = {game_tuple[0]: game_tuple[3] for game_tuple in sb_game_tuples}
+    for game_id, events_df in SB_load_events_for_matches(match_ids=sb_game_ids, last_updated_dates=last_updated_dates):
+        null_counts = events_df.isna().sum()
+
+        for column_name in events_df.columns:
+            column_profile = column_profiles.setdefault(column_name, {"dtypes": set(), "null_count": total_rows,
+                                                                      "max_length": None})
+            column_profile["dtypes"].add(str(events_df[column_name].dtype))
+            column_profile["null_count"] += int(null_counts[column_name])
+
+            # Extract max length for string/list/dict columns, as they would appear as strings in SQL.
+            # Matches with no events have no lengths to measure.
+            if pd.api.types.is_string_dtype(events_df[column_name].dtype) and len(events_df) > 0:
+                max_entry_length = int(events_df[column_name].astype(str).str.len().max())
+                column_profile["max_length"] = max(column_profile["max_length"] or 0, max_entry_length)
+
+        # Columns that don't appear in this match count as null for all of its rows.
+        for column_name in column_profiles.keys() - set(events_df.columns):
+            column_profiles[column_name]["null_count"] += len(events_df)
+
+        total_rows += len(events_df)
+
+    # Combine the dtypes seen in each match into one dtype per column.
+    sb_event_schema = {"total_rows": total_rows, "matches": len(sb_game_ids), "columns": {}}
+    for column_name, column_profile in column_profiles.items():
+        dtypes = column_profile["dtypes"]
+        if len(dtypes) == 1:
+            dtype = dtypes.pop()
+        elif all([pd.api.types.is_numeric_dtype(dtype) for dtype in dtypes]):
+            dtype = str(np.result_type(*dtypes))
+        else:
+            dtype = "object"
+
+        sb_event_schema["columns"][column_name] = {
+            "dtype": dtype,
+            "null_count": column_profile["null_count"],
+            "null_rate": column_profile["null_count"] / total_rows if total_rows > 0 else 0,
+            "max_length": column_profile["max_length"]}
+
+    print(f"Profiled {len(sb_event_schema['columns'])} columns from {total_rows} events in {len(sb_game_ids)} matches.")
+
+    # Save schema so that it can be reused without loading all the events again.
+    if schema_path is not None:
+        with open(schema_path, "w") as schema_file:
+            json.dump(sb_event_schema, schema_file, indent=4)
+
+    return sb_event_schema
+
+
+#%% Load a saved SB event schema.
+
+def SB_load_event_schema(schema_path):
+    """
+    :param   schema_path:     Path of JSON file written by SB_profile_event_schema.
+    :return: sb_event_schema: Dictionary of the SB event schema.
+    """
+    with open(schema_path) as schema_file:
+        return json.load(schema_file)
+
+
+#%% Size the SB string columns of a table for every SB event, using a saved SB event schema.
+
+def add_sb_event_schema_to_registry(schema_registry, sb_event_schema):
+    """
+    :param   schema_registry: Registry of column name -> {"sql_type", "max_length", "guid"}, see update_sql_schema_registry.
+    :param   sb_event_schema: Schema from SB_profile_event_schema or SB_load_event_schema.
+    :return: schema_registry: Registry with the NVARCHAR length of each "sb_" column widened to the longest value of that
+                              column in all SB events, so that later loads don't need to widen them.
+    """
+    for column, column_entry in schema_registry.items():
+        event_column_profile = sb_event_schema["columns"].get(column[len("sb_"):]) if column.startswith("sb_") else None
+        if column_entry["sql_type"] == "NVARCHAR" and event_column_profile is not None:
+            column_entry["max_length"] = max(column_entry["max_length"] or 1, event_column_profile["max_length"] or 0)
+
+    return schema_registry
+
+
+#%% Get all SB event column names.
+
+def get_sb_event_column_names(sb_event_schema=None):
+    """
+    :param   sb_event_schema: Schema from SB_profile_event_schema. All events are profiled if None.
+    :return: all_col_names:   List of all column names that appear in all free SB events data.
+    """
+    if sb_event_schema is None:
+        sb_event_schema = SB_profile_event_schema()
+
+    all_col_names = list(sb_event_schema["columns"])
+
+    return all_col_names
+
+
+#%% Get all SB event column names.
+
+def get_sb_max_length_columns(dict_of_str_colnames, sb_event_schema=None):
+    """
+    :param   dict_of_str_colnames: Dictionary containing all string columns in SB event data with 0 length.
+    :param   sb_event_schema:      Schema from SB_profile_event_schema. All events are profiled if None.
+    :return: dict_of_str_colnames: Updated dictionary with all the maximum characters that appeared for each column in the SB data.
+    """
+    if sb_event_schema is None:
+        sb_event_schema = SB_profile_event_schema()
+
+    # Loop through all SB str column names.
+    for column_name in dict_of_str_colnames:
+        # Sometimes a column name won't appear in the SB data at all.
+        max_entry_length = sb_event_schema["columns"].get(column_name, {}).get("max_length") or 0
+
+        # If this max length is greater than the length already in the dictionary, it overwrites it.
+        if max_entry_length > dict_of_str_colnames[column_name]:
+            dict_of_str_colnames[column_name] = max_entry_length
+
+    return dict_of_str_colnames
+
+
+# all_SB_str_cols = {"type": 0, "player": 0, "position": 0, "team": 0, "possession_team": 0, "pass_body_part": 0, "pass_height": 0,
+#                    "pass_outcome": 0, "pass_recipient": 0, "pass_technique": 0, "pass_type": 0, "shot_body_part": 0, "shot_freeze_frame": 0,
+#                    "shot_outcome": 0, "shot_technique": 0, "shot_type": 0, "dribble_outcome": 0, "duel_outcome": 0, "duel_type": 0,
+#                    "foul_committed_card": 0, "foul_committed_type": 0, "clearance_body_part": 0, "goalkeeper_body_part": 0,
+#                    "goalkeeper_outcome": 0, "goalkeeper_position": 0, "goalkeeper_technique": 0, "goalkeeper_type": 0,
+#                    "substitution_outcome": 0, "substitution_replacement": 0, "bad_behaviour_card": 0, "ball_receipt_outcome": 0,
+#                    "50_50": 0, "interception_outcome": 0, "play_pattern": 0, "related_events": 0, "tactics": 0}
+# max_col_lengths = get_sb_max_length_columns(dict_of_str_colnames=all_SB_str_cols)
+
+#%% Drop columns that do not contain useful data.
+
+def drop_useless_columns(df):
+    """
+    :param   df: Pandas dataframe loaded from SQL database.
+    :return: df: Same dataframe as inputted, but with columns that contain only default values deleted.
+    """
+    # An empty dataframe (e.g. a source with no changed games in an incremental run) has no values to check, and every
+    # column would count as all default. Return it unchanged so the columns needed later on are kept.
+    if len(df) == 0:
+        return df
+
+    # Drop columns containing the substring 'meta'.
+    drop_columns = df.columns[df.columns.str.contains('meta')].tolist()
+
+    # Check each group of columns with the same kind of datatype against its default value in one go.
+    # True/False columns that are all False, numeric columns that are all -1 and string (object when extracted from SQL,
+    # or category from optimise_dtypes) columns that are all N/A should be dropped.
+    for include, default_value in [(bool, False), ("number", -1), (["object", "string", "category"], "N/A")]:
+        block = df.select_dtypes(include=include).drop(columns=drop_columns, errors="ignore")
+
+        # Only columns whose first value is the default can be all default, so the rest aren't scanned.
+        if len(block) > 0:
+            first_is_default = (block.iloc[0] == default_value).to_numpy(dtype=bool)
+            block = block.loc[:, first_is_default]
+
+        is_default = (block == default_value).all(axis=0)
+        drop_columns.extend(is_default.index[is_default.to_numpy()].tolist())
+
+    # Drop the identified columns, keeping the order of the remaining columns.
+    df = df.drop(columns=drop_columns)
+
+    return df
+
+
+#%% Find the columns that drop_useless_columns would keep, on SQL server, so that useless columns are never downloaded.
+
+# Default value that useless columns only contain, for each SQL datatype. Other datatypes are never useless.
+SQL_USELESS_COLUMN_DEFAULTS = {"bit": "0", "tinyint": "-1", "smallint": "-1", "int": "-1", "bigint": "-1",
+                               "float": "-1", "real": "-1", "decimal": "-1", "numeric": "-1",
+                               "nvarchar": "'N/A'", "varchar": "'N/A'"}
+
+
+def build_useful_columns_query(table_schema, table_name, column_types, filters=None):
+    """
+    :param   table_schema: Schema for table/view in SQL.
+    :param   table_name:   Name of table/view you want to check.
+    :param   column_types: Dictionary of column name -> SQL datatype, e.g. from INFORMATION_SCHEMA.COLUMNS.
+    :param   filters:      Dictionary of column name -> filter, see build_select_query.
+    :return: query:        SQL query returning one row, with a 1 for each column that has a value other than its default.
+    :return: params:       List of values for the placeholders in the query.
+    """
+    # NULLs count as useful data, as they aren't equal to the default in Python either.
+    flag_columns = [f"MAX(CASE WHEN [{column}] = {SQL_USELESS_COLUMN_DEFAULTS[sql_type.lower()]} THEN 0 ELSE 1 END) "
+                    f"AS [{column}]"
+                    for column, sql_type in column_types.items() if sql_type.lower() in SQL_USELESS_COLUMN_DEFAULTS]
+
+    # Only check the rows that would be loaded.
+    source_query, params = build_select_query(table_schema=table_schema, table_name=table_name, filters=filters)
+    query = f"SELECT {', '.join(flag_columns)} FROM ({source_query}) AS source"
+
+    return query, params
+
+
+def get_sql_useful_columns(engine, table_schema, table_name, filters=None):
+    """
+    :param   engine:         SQL alchemy engine.
+    :param   table_schema:   Schema for table/view in SQL.
+    :param   table_name:     Name of table/view you want to check.
+    :param   filters:        Dictionary of column name -> filter, see build_select_query.
+    :return: useful_columns: List of the columns that drop_useless_columns would keep for the current rows, in table
+                             order. Pass it as the columns of select_sql_table.
+    """
+    columns_df = pd.read_sql_query(sql=f"""SELECT COLUMN_NAME, DATA_TYPE FROM INFORMATION_SCHEMA.COLUMNS
+                                           WHERE TABLE_SCHEMA = '{table_schema}' AND TABLE_NAME = '{table_name}'
+                                           ORDER BY ORDINAL_POSITION""",
+                                   con=engine)
+    column_types = {column: data_type for column, data_type in zip(columns_df["COLUMN_NAME"], columns_df["DATA_TYPE"])
+                    if 'meta' not in column}
+
+    # Check every column in one scan on the server. Columns with a 0 only contain their default value.
+    query, params = build_useful_columns_query(table_schema=table_schema, table_name=table_name,
+                                               column_types=column_types, filters=filters)
+    has_data = pd.read_sql_query(sql=query, con=engine, params=params or None).iloc[0]
+    useless_columns = set(has_data.index[has_data.to_numpy() == 0])
+
+    useful_columns = [column for column in column_types if column not in useless_columns]
+    logger.info(f"{len(useless_columns)} columns in '{table_schema}.{table_name}' only contain default values and are "
+                f"not loaded.")
+
+    return useful_columns
+
+
+#%% Convert dataframe columns to compact datatypes, and back to the datatypes used for SQL.
+
+def optimise_dtypes(df, guid_columns, max_category_ratio=0.5, keep_default_values=False):
+    """
+    :param   df:                  Pandas dataframe with the datatypes loaded from SQL (int64, float64, object, bool).
+    :param   guid_columns:        List of columns that are GUIDs. Need to specify these as they appear as objects/strings.
+    :param   max_category_ratio:  String columns with at most this ratio of unique values to rows are stored as
+                                  categories.
+    :param   keep_default_values: Keep the default values and float64 columns, so that the dataframe can go through
+                                  drop_useless_columns and the throw-in transforms with the same results as before.
+    :return: df:                  Same dataframe with compact datatypes. Default values (-1, 'N/A' and
+                                  '00000000-0000-0000-0000-000000000000') are stored as missing values, unless
+                                  keep_default_values is True.
+    """
+    memory_before = df.memory_usage(deep=True).sum()
+
+    # Store GUIDs as arrow strings if pyarrow is installed, as they are much smaller than python strings.
+    try:
+        import pyarrow
+        guid_dtype = "string[pyarrow]"
+    except ImportError:
+        guid_dtype = "string"
+
+    optimised_columns = {}
+    for column in df.columns:
+        values = df[column]
+
+        # GUIDs are unique, so are stored as strings rather than categories.
+        if values.dtype == "object" and column in guid_columns:
+            if not keep_default_values:
+                values = values.where(values != '00000000-0000-0000-0000-000000000000')
+            optimised_columns[column] = values.astype(guid_dtype)
+
+        # Strings with few unique values (team, player, pass type etc.) are stored as categories.
+        elif values.dtype == "object":
+            if not keep_default_values:
+                values = values.where(values != "N/A")
+            if values.nunique() <= max_category_ratio * len(values):
+                optimised_columns[column] = values.astype("category")
+            else:
+                optimised_columns[column] = values.astype("string")
+
+        # Integers are downcast to the smallest integer type that fits, which is nullable if -1 is stored as missing.
+        elif values.dtype == "int64":
+            if not keep_default_values:
+                values = values.astype("Int64")
+                values = values.where(values != -1)
+            optimised_columns[column] = pd.to_numeric(values, downcast="integer")
+
+        # Floats are stored with NaN as missing, and as float32 if that doesn't lose any precision. Calculations with
+        # float32 columns are rounded differently, so floats are kept as they are while they are still used.
+        elif values.dtype == "float64" and not keep_default_values:
+            values = values.where(values != -1)
+            float32_values = values.astype("float32")
+            if float32_values.astype("float64").equals(values):
+                optimised_columns[column] = float32_values
+            else:
+                optimised_columns[column] = values
+
+        else:
+            optimised_columns[column] = values
+
+    df = pd.DataFrame(optimised_columns, index=df.index)
+
+    memory_after = df.memory_usage(deep=True).sum()
+    print(f"Dataframe memory reduced from {memory_before / 1024 ** 2:.1f} MB to {memory_after / 1024 ** 2:.1f} MB.")
+
+    return df
+
+
+def restore_sql_dtypes(df, guid_columns):
+    """
+    :param   df:           Pandas dataframe from optimise_dtypes.
+    :param   guid_columns: List of columns that are GUIDs. Need to specify these as they appear as objects/strings.
+    :return: df:           Same dataframe with the datatypes used for SQL (int64, float64, object, bool), and missing
+                           values replaced with the default values (-1, 'N/A' and '00000000-0000-0000-0000-000000000000').
+    """
+    restored_columns = {}
+    for column in df.columns:
+        values = df[column]
+
+        # GUIDs and strings back to python strings.
+        if column in guid_columns and not pd.api.types.is_numeric_dtype(values.dtype):
+            values = values.astype(object)
+            restored_columns[column] = values.where(values.notna(), '00000000-0000-0000-0000-000000000000')
+
+        elif isinstance(values.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(values.dtype):
+            values = values.astype(object)
+            restored_columns[column] = values.where(values.notna(), "N/A")
+
+        # Booleans back to numpy booleans.
+        elif pd.api.types.is_bool_dtype(values.dtype):
+            restored_columns[column] = values.fillna(False).astype(bool)
+
+        # Integers and floats back to int64 and float64.
+        elif pd.api.types.is_integer_dtype(values.dtype):
+            restored_columns[column] = values.fillna(-1).astype("int64")
+
+        elif pd.api.types.is_float_dtype(values.dtype):
+            restored_columns[column] = values.fillna(-1).astype("float64")
 
-#%% Connect to SQL server.
+        else:
+            restored_columns[column] = values
+
+    df = pd.DataFrame(restored_columns, index=df.index)
+
+    return df
+
+
+#%% Convert coordinates between the pitch coordinate systems of different data sources.
+
+# Range of x (length) and y (width) coordinates on each data source's pitch. y isn't flipped between sources, the same
+# as the original Opta <-> Statsbomb conversion. Add data sources here to convert to and from them.
+PITCH_SPECS = {"Statsbomb": {"x_range": (0, 120), "y_range": (0, 80)},
+               "Opta": {"x_range": (0, 100), "y_range": (0, 100)},
+               "Wyscout": {"x_range": (0, 100), "y_range": (0, 100)},
+               "Metric": {"x_range": (0, 105), "y_range": (0, 68)},
+               "Metric centred": {"x_range": (-52.5, 52.5), "y_range": (-34, 34)},
+               "Tracab": {"x_range": (-5250, 5250), "y_range": (-3400, 3400)}}
 
-def connect_to_sql_server():
+
+def get_coords_transform(input_data_source, output_data_source, x_or_y):
     """
-    :param   server:       Name of SQL server you want to connect to.
-    :param   database:     Name of database you want to connect to.
-    :param   username:     Azure account username.
-    :return: conn, cursor: Connection to server, cursor for server.
+    :param   input_data_source:  Data source of the coordinates, a key of PITCH_SPECS.
+    :param   output_data_source: Data source to convert the coordinates to, a key of PITCH_SPECS.
+    :param   x_or_y:             Converting x or y coordinates. Different pitch dimensions for length and width.
+    :return: scale, offset:      Converted value = value * scale + offset.
     """
+    for data_source in [input_data_source, output_data_source]:
+        if data_source not in PITCH_SPECS:
+            raise ValueError(f"Data source {data_source} has no pitch spec. Data sources = {list(PITCH_SPECS)}")
 
-    # Input server and database name.
-    server = input("Enter server name:")
-    database = input("Enter database name:")
+    if x_or_y not in ["x", "y"]:
+        raise ValueError("Conversion only available for x and y coordinates.")
 
-    # Connection string is different depending on if connection is local or not.
-    if server == "localhost":
+    input_min, input_max = PITCH_SPECS[input_data_source][f"{x_or_y}_range"]
+    output_min, output_max = PITCH_SPECS[output_data_source][f"{x_or_y}_range"]
 
-        # Connection to server/database.
-        conn_string = "Driver={ODBC Driver 18 for SQL Server}" + \
-                      ";Server=" + server + \
-                      ";Database=" + database + \
-                      ";Trusted_Connection=yes" + \
-                      ";TrustServerCertificate=yes"
+    scale = (output_max - output_min) / (input_max - input_min)
+    offset = output_min - input_min * scale
 
-    else:
-        # Input username and password. Needed for non-local connections.
-        username = input("Enter username:")
+    return scale, offset
 
-        # Connection to server/database.
-        conn_string = 'DRIVER={ODBC Driver 18 for SQL Server}' \
-                      ';SERVER=tcp:' + server +\
-                      ';PORT=1433' +\
-                      ';DATABASE=' + database + \
-                      ';UID=' + username + \
-                      ';Authentication=ActiveDirectoryInteractive;'
 
-    # Connection to server.
-    conn = pyodbc.connect(conn_string)
+def convert_coords(value, input_data_source, output_data_source, x_or_y):
+    """
+    :param value:              Value that will be converted, can be integer/float or pandas column.
+    :param input_data_source:  Source where inputted value comes from, e.g. "Statsbomb" or "Opta". See PITCH_SPECS.
+    :param output_data_source: What outputted value's data source should be, e.g. "Statsbomb" or "Opta".
+    :param x_or_y:             Converting x or y coordinates. Different pitch dimensions for length and width.
+    :return: converted_value:  Value in the output data source's coordinates. Raises ValueError for invalid input.
+    """
+    # E.g. length of Opta pitch is 100, SB is 120, so Opta x coordinates are multiplied by (120/100) = 1.2.
+    scale, offset = get_coords_transform(input_data_source=input_data_source, output_data_source=output_data_source,
+                                         x_or_y=x_or_y)
+    converted_value = value * scale + offset if offset != 0 else value * scale
 
-    # Cursor for database.
-    cursor = conn.cursor()
+    return converted_value
 
-    return conn, cursor
 
+def transform_coords(x, y, input_data_source, output_data_source, flip=None, in_place=False):
+    """
+    :param   x:                  NumPy array of x coordinates. Can be 2D to convert several columns in one call, e.g.
+                                 np.stack([x, end_x]). None if only y coordinates are converted.
+    :param   y:                  NumPy array of y coordinates, the same shape as x. None if only x is converted.
+    :param   input_data_source:  Data source of the coordinates, a key of PITCH_SPECS.
+    :param   output_data_source: Data source to convert the coordinates to, a key of PITCH_SPECS.
+    :param   flip:               True, or boolean array broadcastable to x and y, for coordinates whose direction of
+                                 play should be flipped (pitch rotated 180 degrees), e.g. where possession changed.
+    :param   in_place:           Overwrite x and y instead of returning new arrays. They must be float arrays.
+    :return: x, y:               Converted coordinates. Raises ValueError for invalid input.
+    """
+    if x is None and y is None:
+        raise ValueError("No coordinates to convert.")
 
-#%% Connect to SQL server using SQL alchemy.
+    if x is not None and y is not None and np.shape(x) != np.shape(y):
+        raise ValueError(f"x and y coordinates have different shapes: {np.shape(x)} and {np.shape(y)}.")
+
+    converted_coords = []
+    for coords, x_or_y in [(x, "x"), (y, "y")]:
+        if coords is None:
+            converted_coords.append(None)
+            continue
+
+        if in_place and not (isinstance(coords, np.ndarray) and np.issubdtype(coords.dtype, np.floating)):
+            raise ValueError(f"{x_or_y} coordinates must be a float NumPy array to be converted in place.")
+
+        if not in_place:
+            coords = np.array(coords, dtype=float)
+
+        if not np.issubdtype(coords.dtype, np.number):
+            raise ValueError(f"{x_or_y} coordinates must be numeric. Datatype = {coords.dtype}")
+
+        scale, offset = get_coords_transform(input_data_source=input_data_source,
+                                             output_data_source=output_data_source, x_or_y=x_or_y)
 
-def connect_to_sql_alchemy_server():
+        # Flipping the direction of play mirrors the coordinate around the middle of the output pitch, which is folded
+        # into the scale and offset so that each coordinate is only multiplied and added to once.
+        if flip is not None and flip is not False:
+            output_min, output_max = PITCH_SPECS[output_data_source][f"{x_or_y}_range"]
+            scale = np.where(flip, -scale, scale)
+            offset = np.where(flip, output_min + output_max - offset, offset)
+
+        np.multiply(coords, scale, out=coords)
+        np.add(coords, offset, out=coords)
+        converted_coords.append(coords)
+
+    return converted_coords[0], converted_coords[1]
+
+
+#%% Extract all throw-in events and the event preceding them.
+
+def extract_throw_ins_and_preceding_event(throw_ins_df, data_source, look_back=3):
     """
-        :param   server:   Name of SQL server you want to connect to.
-        :param   database: Name of database you want to connect to.
-        :param   username: Azure account username.
-        :return: engine:   SQL alchemy engine connected to desired SQL server.
+    :param   throw_ins_df: Fact table for throw-ins as a pandas dataframe.
+    :param   data_source:  String indicating if throws come from 'Statsbomb' or 'Opta'.
+    :param   look_back:    Number of events before each throw-in that the Fact table holds. Default is 3.
+    :return  throw_ins_df: Same Fact table but with rows filtered out.
     """
 
-    # Input server and database name.
-    server = input("Enter server name:")
-    database = input("Enter database name:")
+    # Use SB or Opta indexes to order dataframe and extract throw-ins, depending on which data source you're looking for.
+    if data_source == "Statsbomb":
+        # Order dataframe and reset index to guarantee the order of the preceding events before a throw-in.
+        throw_ins_df = throw_ins_df.sort_values(by=["dim_game_id", "sb_event_index"]).reset_index(drop=True)
 
-    # Connection string is different depending on if connection is local or not.
-    if server == "localhost":
-        # Connection to server/database.
-        params = urllib.parse.quote_plus("Driver={ODBC Driver 18 for SQL Server}" + \
-                                          ";Server=" + server + \
-                                          ";Database=" + database + \
-                                          ";Trusted_Connection=yes" + \
-                                          ";TrustServerCertificate=yes")
-        conn_string = "mssql+pyodbc:///?odbc_connect={}".format(params)
+        # Flag all throw-ins.
+        is_throw_in = (throw_ins_df["sb_pass_type"] == "Throw-in").to_numpy()
+
+    elif data_source == "Opta":
+        # Order dataframe and reset index to guarantee the order of the preceding events before a throw-in.
+        throw_ins_df = throw_ins_df.sort_values(by=["dim_game_id", "opta_event_index"]).reset_index(drop=True)
 
-        # Localhost can handle all rows being inserted at once, so fast_executemany is set to True.
-        engine = sqlalchemy.create_engine(conn_string, echo=True, fast_executemany=True)
+        # Flag all throw-ins.
+        is_throw_in = (throw_ins_df["opta_pass_throw_in"] == 1).to_numpy()
 
     else:
-        # Input username and password. Needed for non-local connections.
-        username = input("Enter username:")
+        print("Data source does not exist. Please select either Statsbomb or Opta")
+        return
 
-        # Connection to server/database.
-        params = urllib.parse.quote_plus('DRIVER={ODBC Driver 18 for SQL Server}' \
-                                         ';SERVER=tcp:' + server + \
-                                         ';PORT=1433' + \
-                                         ';DATABASE=' + database + \
-                                         ';UID=' + username + \
-                                         ';Authentication=ActiveDirectoryInteractive;')
-        conn_string = "mssql+pyodbc:///?odbc_connect={}".format(params)
+    game_ids = throw_ins_df["dim_game_id"].to_numpy()
+    number_of_rows = len(throw_ins_df)
+
+    # For every row, flag if the event k rows further on is a throw-in from the same game, for k = 1 to look_back.
+    # Comparing game ids stops events at the end of one game being treated as coming before a throw in the next game.
+    throw_in_k_events_later = []
+    for k in range(1, look_back + 1):
+        later_is_throw_in = np.zeros(number_of_rows, dtype=bool)
+        later_is_throw_in[:-k] = is_throw_in[k:] & (game_ids[k:] == game_ids[:-k])
+        throw_in_k_events_later.append(later_is_throw_in)
+
+    # Remove events that are 2 to look_back events before a throw-in, unless they are a throw-in themselves or
+    # are directly before a throw-in. This leaves each throw-in with only the event directly preceding it.
+    if look_back >= 2:
+        within_look_back = np.logical_or.reduce(throw_in_k_events_later[1:])
+    else:
+        within_look_back = np.zeros(number_of_rows, dtype=bool)
+    rows_to_delete = within_look_back & ~is_throw_in & ~throw_in_k_events_later[0]
 
-        # Foreign SQL server can't handle all rows being inserted at once, so fast_executemany is set to False.
-        engine = sqlalchemy.create_engine(conn_string, echo=True, fast_executemany=False)
+    logger.info(f"{rows_to_delete.sum()} rows removed that were more than 1 event before a throw-in.")
+    logger.debug(f"Row indexes removed: {throw_ins_df.index[rows_to_delete].tolist()}")
 
-    return engine
+    # Remove rows from the dataframe.
+    throw_ins_df = throw_ins_df[~rows_to_delete]
 
+    return throw_ins_df
 
-#%% Select table from SQL server.
 
-def select_sql_table(table_schema, table_name, connection):
+#%% Add column to dataframe showing how far a player gained on a throw.
+
+def add_throw_in_column(throw_ins_df, data_source):
     """
-    :param   table_schema: Schema for table/view in SQL.
-    :param   table_name:   Name of table/view you want to load data from.
-    :param   connection:   Connection to SQL server.
-    :return: table_df:     Pandas dataframe of table from SQL.
+    :param throw_ins_df:  Fact table for throw-ins as a pandas dataframe.
+    :param data_source:   String indicating if throws come from 'Statsbomb' or 'Opta'.
+    :return throw_ins_df: Same Fact table but with column indicating how many metres were 'stolen' for a throw-in.
     """
-    # Define SQL query.
-    input_query = f"""SELECT * FROM [{table_schema}].[{table_name}]
-                      WHERE meta_is_current = 1"""
+    # Add empty column to dataframe with default value -1.0001.
+    throw_ins_df["metres_gained"] = -1.0001
+
+    # Use SB or Opta columns to flag throw-ins and non-throw-ins, depending on which data source you're looking for.
+    if data_source == "Statsbomb":
+        is_throw_in = throw_ins_df["sb_pass_type"] == "Throw-in"
+        is_non_throw_in = throw_ins_df["sb_pass_type"] != "Throw-in"
+
+    elif data_source == "Opta":
+        is_throw_in = throw_ins_df["opta_pass_throw_in"] == 1
+        is_non_throw_in = throw_ins_df["opta_pass_throw_in"] == 0
+
+        # Convert Opta x and y coords (start and end of each event) to SB in one call, so that all the metres_gained is
+        # kept consistent. Copies are asked for, as pandas can return a read-only view that can't be converted in place.
+        x_coords = np.ascontiguousarray(throw_ins_df[["opta_x_coord", "opta_pass_end_x_coord"]]
+                                        .to_numpy(dtype=float, na_value=np.nan, copy=True).T)
+        y_coords = np.ascontiguousarray(throw_ins_df[["opta_y_coord", "opta_pass_end_y_coord"]]
+                                        .to_numpy(dtype=float, na_value=np.nan, copy=True).T)
+        transform_coords(x=x_coords, y=y_coords, input_data_source="Opta", output_data_source="Statsbomb",
+                         in_place=True)
+        throw_ins_df["converted_sb_x_coord"] = x_coords[0]
+        throw_ins_df["converted_sb_y_coord"] = y_coords[0]
+        throw_ins_df["converted_sb_end_x_coord"] = x_coords[1]
+        throw_ins_df["converted_sb_end_y_coord"] = y_coords[1]
 
-    # Initialise start time to see how long it takes to loop through one game.
-    start_time = time.time()
+    else:
+        print("Data source does not exist. Please select either 'Statsbomb' or 'Opta'")
+        return
 
-    # Extract table from SQL server.
-    table_df = pd.read_sql_query(sql=input_query, con=connection)
+    # Align every row with the row whose index is one lower (the event before). Rows removed by the preceding event
+    # filter leave gaps in the index, so this is done by index label rather than by position.
+    previous_index = throw_ins_df.index - 1
+    previous_is_non_throw_in = is_non_throw_in.reindex(previous_index, fill_value=False).to_numpy()
 
-    # Finish time of extracting the table.
-    end_time = time.time()
+    # The event before must be from the same game, otherwise the first throw-in of a game would use the last event of
+    # the game before it.
+    previous_is_same_game = throw_ins_df["dim_game_id"].to_numpy() == \
+                            throw_ins_df["dim_game_id"].reindex(previous_index).to_numpy()
 
-    print(f"Table/View loaded in {(end_time - start_time) / 60} minutes.")
+    # Only calculate metres gained for throw-ins that had passes as events before them.
+    calculate_mask = is_throw_in.to_numpy() & previous_is_non_throw_in & previous_is_same_game
 
-    return table_df
+    if data_source == "Statsbomb":
+        x_coord = throw_ins_df["sb_x_coord"].to_numpy(dtype=float)
+        previous_end_x_coord = throw_ins_df["sb_pass_end_x_coord"].reindex(previous_index).to_numpy(dtype=float)
 
+        # SB: Pitch coordinates flip if possession changes hands, so the end of the previous pass is mirrored (120 - x).
+        # If possession doesn't change (pass event before was blocked/deflected), coordinates are used as they are.
+        possession_changed = throw_ins_df["dim_team_id"].to_numpy() != \
+                             throw_ins_df["dim_team_id"].reindex(previous_index).to_numpy()
+        previous_end_x_coord, _ = transform_coords(x=previous_end_x_coord, y=None, input_data_source="Statsbomb",
+                                                   output_data_source="Statsbomb", flip=possession_changed)
+        distance_gained = x_coord - previous_end_x_coord
 
-# %% Load in a certain season from a certain league.
+    else:
+        # Opta: All 'Out' events before the throws have been guaranteed to be for the team that will take the throw.
+        x_coord = throw_ins_df["converted_sb_x_coord"].to_numpy(dtype=float)
+        previous_x_coord = throw_ins_df["converted_sb_x_coord"].reindex(previous_index).to_numpy(dtype=float)
+        distance_gained = x_coord - previous_x_coord
 
-def SB_load_matches_from_season(league_name, season_name):
+    # Add the metres gained for each throw to the specific throw-in rows.
+    throw_ins_df["metres_gained"] = np.where(calculate_mask, np.round(distance_gained, 2), -1.0001)
+
+    return throw_ins_df
+
+
+#%% Run the per-game throw-in transforms in parallel.
+
+def transform_throw_ins(throw_ins_df, data_source, look_back=3):
     """
-    :param   league_name: Name of the league that you want data from (str) E.g. Premier League
-    :param   season_name: Name of the season that you want data from (str) E.g. 2003/2004
-    :return: matches_df:  Dataframe of all matches from selected season of selected league.
+    :param   throw_ins_df: Fact table for throw-ins as a pandas dataframe.
+    :param   data_source:  String indicating if throws come from 'Statsbomb' or 'Opta'.
+    :param   look_back:    Number of events before each throw-in that the Fact table holds.
+    :return: throw_ins_df: Throw-ins and the event before them, with the metres_gained column.
     """
+    throw_ins_df = extract_throw_ins_and_preceding_event(throw_ins_df=throw_ins_df, data_source=data_source,
+                                                         look_back=look_back)
+    throw_ins_df = add_throw_in_column(throw_ins_df=throw_ins_df, data_source=data_source)
 
-    # The competitions that have Statsbomb data available.
-    competitions_df = sb.competitions()
+    return throw_ins_df
 
-    # Extract SB competition id for desired competition.
-    comp_id = competitions_df['competition_id'][
-        (competitions_df['competition_name'] == league_name) & (competitions_df['season_name'] == season_name)].array[0]
 
-    # Extract SB season id for desired season.
-    seas_id = competitions_df['season_id'][
-        (competitions_df['competition_name'] == league_name) & (competitions_df['season_name'] == season_name)].array[0]
+def transform_throw_ins_shard(shard, data_source, look_back, output_path=None):
+    """
+    :param   shard:        Dataframe of the games in the shard, or path of an Arrow IPC file containing them.
+    :param   data_source:  String indicating if throws come from 'Statsbomb' or 'Opta'.
+    :param   look_back:    Number of events before each throw-in that the Fact table holds.
+    :param   output_path:  Path of Arrow IPC file that the result is written to. The result is returned if None.
+    :return: throw_ins_df: Transformed shard, or output_path if the result was written to a file.
+    """
+    # Read the shard straight from the memory mapped file written by the parent process.
+    if isinstance(shard, str):
+        import pyarrow as pa
+        with pa.memory_map(shard) as source:
+            shard = pa.ipc.open_file(source).read_all().to_pandas()
 
-    # Return the matches for the desired competition.
-    matches_df = sb.matches(competition_id=comp_id, season_id=seas_id).sort_values(by='match_date')
+    throw_ins_df = transform_throw_ins(throw_ins_df=shard, data_source=data_source, look_back=look_back)
 
-    return matches_df
+    if output_path is None:
+        return throw_ins_df
 
+    import pyarrow as pa
+    table = pa.Table.from_pandas(throw_ins_df, preserve_index=False)
+    with pa.OSFile(output_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
 
-#%% Get all unique SB competition + season ids.
+    return output_path
 
-def SB_get_unique_competitions(sb_competitions_df):
+
+def transform_throw_ins_in_parallel(throw_ins_df, data_source, max_workers=None, games_per_shard=200, look_back=3):
     """
-    :param  sb_competitions_df: The Statsbomb free competitions dataframe.
-    :return comp_season_ids:    List of tuples containing all unique SB competition + season ids.
+    :param   throw_ins_df:    Fact table for throw-ins as a pandas dataframe.
+    :param   data_source:     String indicating if throws come from 'Statsbomb' or 'Opta'.
+    :param   max_workers:     Number of worker processes. Defaults to the number of CPUs.
+    :param   games_per_shard: Number of games given to a worker at a time.
+    :param   look_back:       Number of events before each throw-in that the Fact table holds.
+    :return: throw_ins_df:    Same result as transform_throw_ins, in game order. Events are never treated as coming
+                              before a throw-in from a different game.
     """
-    # Get a list of all unique competition + season ids in SB data.
-    comp_season_ids = []
-    for comp_id, seas_id in zip(sb_competitions_df.competition_id, sb_competitions_df.season_id):
-        # Combine competition and season ids into one tuple.
-        comp_season_tuple = (comp_id, seas_id)
+    # Initialise start time to see how long the transforms take.
+    start_time = time.time()
 
-        # Ensure only unique tuples are added to the list of competition and season ids.
-        if comp_season_tuple not in comp_season_ids:
-            comp_season_ids.append(comp_season_tuple)
+    # Split the games into shards of consecutive game ids, so that joining the shards in order keeps games in order.
+    game_ids = np.sort(throw_ins_df["dim_game_id"].unique())
+    shard_starts = game_ids[::games_per_shard]
+    shard_numbers = np.searchsorted(shard_starts, throw_ins_df["dim_game_id"].to_numpy(), side="right") - 1
+    shards = [shard_df for _, shard_df in throw_ins_df.groupby(shard_numbers, sort=True)]
+
+    # Hand shards to the workers as Arrow IPC files if pyarrow is installed, otherwise as pickled dataframes.
+    try:
+        import pyarrow as pa
+    except ImportError:
+        pa = None
+
+    with tempfile.TemporaryDirectory() as temp_folder, ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for shard_number, shard_df in enumerate(shards):
+            if pa is None:
+                futures.append(executor.submit(transform_throw_ins_shard, shard_df, data_source, look_back))
+                continue
+
+            input_path = os.path.join(temp_folder, f"shard_{shard_number}_input.arrow")
+            output_path = os.path.join(temp_folder, f"shard_{shard_number}_output.arrow")
+            table = pa.Table.from_pandas(shard_df, preserve_index=False)
+            with pa.OSFile(input_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            futures.append(executor.submit(transform_throw_ins_shard, input_path, data_source, look_back, output_path))
+
+        # Collect the results in shard order, so the output is the same however long each worker takes.
+        result_dfs = []
+        for future in futures:
+            result = future.result()
+            if isinstance(result, str):
+                with pa.memory_map(result) as source:
+                    result = pa.ipc.open_file(source).read_all().to_pandas()
+            result_dfs.append(result)
+
+    throw_ins_df = pd.concat(result_dfs, ignore_index=True)
+
+    # Finish time of the transforms.
+    end_time = time.time()
+    print(f"{data_source} throw-ins transformed in {len(shards)} shards in {(end_time - start_time) / 60} minutes.")
 
-    return comp_season_ids
+    return throw_ins_df
 
 
-#%% Get tuples with all unique SB game ids, competition ids, season ids and modified dates.
+#%% Fill NaN values based on data type. Used for merging the dataframes below.
 
-def SB_get_unique_games(comp_season_ids):
+def get_fill_value_based_on_datatype(column, data_type, guid_columns):
     """
-    :param   comp_season_ids: List of tuples containing all unique SB competition + season ids.
-    :return: sb_game_tuples:  List of tuples containing unique SB game ids, competition ids, season ids, and modified dates.
-    :return: sb_game_ids:     List of all unique SB game ids.
+    :param column:        Name of the column.
+    :param data_type:     Datatype of the column.
+    :param guid_columns:  List of columns that are GUIDs. Need to specify these as they appear as objects/strings.
+    :return: fill_value:  Value that replaces NaN values in the column. None if the datatype isn't filled.
     """
-    # Get a list of tuples that include all the SB game ids, competition ids, season ids and modified date.
-    sb_game_tuples = []
-    sb_game_ids = []
-    for comp_season_id in comp_season_ids:
-        # Extract dataframe of games from specified competition + season.
-        # Added try/except as one competition is not giving a dataframe on SB side.
-        try:
-            game_df = sb.matches(competition_id=comp_season_id[0], season_id=comp_season_id[1])
+    # Fill with False if series is True/False. Checked first, as booleans also count as numbers.
+    if pd.api.types.is_bool_dtype(data_type):
+        return False
 
-            # Add unique games to the list of game ids.
-            for id, mod_date in zip(game_df.match_id, game_df.last_updated):
-                if id not in sb_game_ids:
-                    sb_game_ids.append(id)
-                    sb_game_tuples.append((id, comp_season_id[0], comp_season_id[1], pd.to_datetime(mod_date)))
-
-        except AttributeError:
-            print(f"comp_id = {comp_season_id[0]}, season_id = {comp_season_id[1]} match dataframe does not exist.")
+    # Fill with -1 if series is float/integer, including the smaller integers from optimise_dtypes.
+    elif pd.api.types.is_numeric_dtype(data_type):
+        return -1
 
-    return sb_game_tuples, sb_game_ids
+    # Fill with '00000000-0000-0000-0000-000000000000' if series is a GUID, or 'N/A' if series is a string.
+    # These both appear as objects, strings or categories in Python.
+    elif pd.api.types.is_string_dtype(data_type) or isinstance(data_type, pd.CategoricalDtype):
+        return '00000000-0000-0000-0000-000000000000' if column in guid_columns else 'N/A'
 
+    return None
 
-#%% Get all unique SB event ids.
 
-def SB_get_unique_events(sb_game_ids):
+def fill_nan_values_based_on_datatype(df, guid_columns):
     """
-    :param   sb_game_ids:   List containing all SB game ids.
-    :return: unique_events: List of all unique event ids for all SB event data.
+    :param df:           Dataframe that you want to replace NaN values with something else.
+    :param guid_columns: List of columns that are GUIDs. Need to specify these as they appear as objects/strings.
+    :return: df:         Copy of the dataframe with all NaN values filled in.
     """
-    # Initialise list that will contain all unique SB event ids.
-    unique_events = []
-
-    # Loop through all SB unique game ids.
-    for game_id in sb_game_ids:
-        # Define events dataframe for specific game.
-        events_df = sb.events(match_id=game_id)
+    fill_values = {column: get_fill_value_based_on_datatype(column, data_type, guid_columns)
+                   for column, data_type in df.dtypes.items()}
 
-        # Add all unique event ids to list.
-        for event_id in events_df["id"]:
-            if event_id not in unique_events:
-                unique_events.append(event_id)
+    # Categories can only be filled with one of their categories, so the fill value is added as a category first.
+    for column, fill_value in fill_values.items():
+        if isinstance(df[column].dtype, pd.CategoricalDtype) and fill_value not in df[column].cat.categories and \
+                df[column].isna().any():
+            df = df.assign(**{column: df[column].cat.add_categories([fill_value])})
 
-    return unique_events
+    # Fill every column at once.
+    return df.fillna({column: value for column, value in fill_values.items() if value is not None})
 
 
-#%% Extract value from SB event column.
+#%% Merge throw-ins from any number of data sources into one dataframe.
 
-def SB_extract_event_column_value(events_df, event_row, column_name, column_type):
+def merge_throw_in_sources(throw_ins_dfs, guid_columns):
     """
-    :param:  events_df:   SB events dataframe for a specific match.
-    :param:  event_row:   The row number for the event.
-    :param:  column_name: Name of the column in the events_df.
-    :param:  column_type: 7 choices for what column type the value is coming from ("T/F", "id", "str", "int", "float", "coords", "coords_z")
-    :return: value:       Desired value from a specified column and row from event dataframe.
+    :param throw_ins_dfs: List of pandas dataframes containing throw-ins and their preceding event, one per data source.
+    :param guid_columns:  List of columns that are GUIDs. Need to specify these as they appear as objects/strings.
+    :return: merged_df:   Combined dataframe containing all dataframes. Columns missing from a data source are filled
+                          with the default value for the column's datatype.
     """
-    # Not all columns exist in every SB event dataframe, so KeyErrors occur when you attempt to use a column that
-    # isn't present in the specified event dataframe.
-    # If column type is True/False, we want values that don't exist to return 0, there are no 'False' entries in SB data, just nan.
-    if column_type == "T/F":
-        try:
-            value = str(events_df.loc[event_row, column_name])
-            if value == "nan":
-                value = 0
-            elif value == "True":
-                value = 1
-        except KeyError:
-            value = 0
+    # Target schema is every column in the order it first appears, with the datatype of the first data source that has it.
+    target_dtypes = {}
+    for throw_ins_df in throw_ins_dfs:
+        for column, data_type in throw_ins_df.dtypes.items():
+            target_dtypes.setdefault(column, data_type)
+    target_columns = list(target_dtypes)
+
+    aligned_dfs = []
+    for throw_ins_df in throw_ins_dfs:
+        # Fill NaN values in the columns the data source already has, all at once.
+        filled_df = fill_nan_values_based_on_datatype(df=throw_ins_df, guid_columns=guid_columns)
+
+        # Build the columns the data source doesn't have. Booleans stay booleans, integers become floats (as they would
+        # if they were added as NaN), strings, categories and GUIDs are objects.
+        missing_columns = {}
+        for column in target_columns:
+            if column in throw_ins_df.columns:
+                continue
+            data_type = target_dtypes[column]
+            fill_value = get_fill_value_based_on_datatype(column, data_type, guid_columns)
+            if pd.api.types.is_bool_dtype(data_type):
+                missing_columns[column] = np.zeros(len(throw_ins_df), dtype=bool)
+            elif pd.api.types.is_numeric_dtype(data_type):
+                missing_columns[column] = np.full(len(throw_ins_df), fill_value, dtype="float64")
+            elif pd.api.types.is_string_dtype(data_type) or isinstance(data_type, pd.CategoricalDtype):
+                missing_columns[column] = np.full(len(throw_ins_df), fill_value, dtype=object)
+            else:
+                missing_columns[column] = pd.Series(index=throw_ins_df.index, dtype=data_type)
 
-    # If column type is GUID id, we want values that don't exist to return None.
-    elif column_type == "id":
-        try:
-            value = str(events_df.loc[event_row, column_name])
-            if value == "nan":
-                value = None
-        except KeyError:
-            value = None
+        # Put the columns in the order of the target schema.
+        aligned_df = pd.concat([filled_df, pd.DataFrame(missing_columns, index=throw_ins_df.index)], axis=1)
+        aligned_dfs.append(aligned_df[target_columns])
 
-    # If column type is a string, we want values that don't exist to return N/A.
-    elif column_type == "str":
-        try:
-            value = str(events_df.loc[event_row, column_name])
-            if value == "nan":
-                value = "N/A"
-        except KeyError:
-            value = "N/A"
+    # Combine the dataframes.
+    merged_df = pd.concat(aligned_dfs, axis=0, ignore_index=True)
 
-    # If column type is a float, we want values that don't exist to return 9999.
-    elif column_type == "int":
-        try:
-            value = events_df.loc[event_row, column_name]
-            if str(value) == "nan":
-                value = -1 # Changed 14/01/24: Previously was 999999
-            else:
-                value = int(value)
-        except KeyError:
-            value = -1 # Changed 14/01/24: Previously was 999999
+    # Add meta_is_current column to merged dataframe.
+    merged_df["meta_is_current"] = True
 
-    # If column type is a float, we want values that don't exist to return 9999.
-    elif column_type == "float":
-        try:
-            value = events_df.loc[event_row, column_name]
-            if str(value) == "nan":
-                value = -1 # Changed 14/01/24: Previously was 999999
-            else:
-                value = float(value)
-        except KeyError:
-            value = -1 # Changed 14/01/24: Previously was 999999
+    return merged_df
 
-    # If column type is x and y coordinates, we want values that don't exist to return (9999, 9999).
-    elif column_type == "coords":
-        try:
-            value = events_df.loc[event_row, column_name]
-            if str(value) == "nan":
-                value = (-1, -1) # Changed 14/01/24: Previously was (999999, 999999)
-            else:
-                value = (value[0], value[1])
-        except KeyError:
-            value = (-1, -1) # Changed 14/01/24: Previously was (999999, 999999)
 
-    # If column type is x, y, z coordinates, we want values that don't exist to return (-1, -1, -1).
-    # This is for shot end location qualifier, if shot is on target, z coord is included, not included otherwise.
-    elif column_type == "coords_z":
-        try:
-            value = events_df.loc[event_row, column_name]
-            if str(value) == "nan":
-                value = (-1, -1, -1) # Changed 14/01/24: Previously was (999999, 999999, 999999)
-            elif len(value) == 2:
-                value = (value[0], value[1], -1) # Changed 14/01/24: Previously was (..., ..., 999999)
-            else:
-                value = (value[0], value[1], value[2])
-        except KeyError:
-            value = (-1, -1, -1) # Changed 14/01/24: Previously was (999999, 999999, 999999)
+#%% Merge the Opta and SB throw-ins into one dataframe.
 
-    else:
-        print(f"Column type {column_type} is incorrect for {column_name}.")
+def merge_sb_and_opta_throw_ins(sb_throw_ins, opta_throw_ins, guid_columns):
+    """
+    :param sb_throw_ins:   Pandas dataframe containing Statsbomb throw-ins and their preceding event.
+    :param opta_throw_ins: Pandas dataframe containing Opta throw-ins and their preceding event.
+    :param guid_columns:   List of columns that are GUIDs. Need to specify these as they appear as objects/strings.
+    :return: merged_df:    Combined dataframe containing both dataframes.
+    """
+    merged_df = merge_throw_in_sources(throw_ins_dfs=[sb_throw_ins, opta_throw_ins], guid_columns=guid_columns)
 
-    return value
+    return merged_df
 
 
-#%% Get all SB event column names.
+#%% Store the throw-ins sorted by game, with an index of the rows for each game, team and player.
+
+# Files in a throw-in sequence store folder.
+SEQUENCE_STORE_FILES = {"table": "throw_ins.arrow", "game_offsets": "game_offsets.arrow", "game_index": "game_index.arrow"}
 
-def get_sb_event_column_names():
+
+def write_throw_in_sequence_store(throw_ins_df, store_folder, index_columns=("dim_team_id", "dim_player_id",
+                                                                              "dim_competition_id", "dim_season_id"),
+                                  replace_game_ids=None):
     """
-    :return: all_col_names: List of all column names that appear in all free SB events data.
+    :param   throw_ins_df:     Pandas dataframe of throw-ins and their preceding events, e.g. Fact.Throw_Ins.
+    :param   store_folder:     Folder the store is written to.
+    :param   index_columns:    Columns to build an index of game ids for. Columns that aren't in the data are skipped,
+                               as are missing values (e.g. unknown players stored as missing by optimise_dtypes).
+    :param   replace_game_ids: List of game ids that throw_ins_df replaces in the existing store, for incremental
+                               loads. The whole store is rewritten from throw_ins_df if None.
+    :return: Writes the rows sorted by game and event index as an Arrow IPC file, along with a table of the first and
+             last row of each game and a table of index column value -> game id.
     """
-    # Load in Statsbomb (SB) competition data.
-    sb_competitions = sb.competitions()
+    import pyarrow as pa
+    import pyarrow.compute as pc
 
-    # Get a list of all unique competition + season ids in SB data.
-    comp_season_ids = SB_get_unique_competitions(sb_competitions_df=sb_competitions)
+    # Initialise start time to see how long it takes to write the store.
+    start_time = time.time()
 
-    # Get a list of tuples that include all the SB game ids, competition ids, season ids and modified date.
-    sb_game_tuples, sb_game_ids = SB_get_unique_games(comp_season_ids=comp_season_ids)
+    os.makedirs(store_folder, exist_ok=True)
+    table_path = os.path.join(store_folder, SEQUENCE_STORE_FILES["table"])
+    table = pa.Table.from_pandas(throw_ins_df, preserve_index=False)
+
+    # Keep the games that haven't changed from the existing store. It is read into memory rather than memory mapped,
+    # so that the file can be replaced afterwards.
+    if replace_game_ids is not None and os.path.exists(table_path):
+        with pa.OSFile(table_path, "rb") as source:
+            existing_table = pa.ipc.open_file(source).read_all()
+        replaced_games = pc.is_in(existing_table["dim_game_id"],
+                                  value_set=pa.array(replace_game_ids, type=existing_table["dim_game_id"].type))
+        existing_table = existing_table.filter(pc.invert(replaced_games))
+
+        # Columns and datatypes can differ between loads, so they are combined into the widest datatype.
+        table = pa.concat_tables([existing_table, table], promote_options="permissive")
+
+    elif replace_game_ids is not None:
+        logger.warning(f"No sequence store in '{store_folder}' to update, so it only holds the replaced games. "
+                       f"Run a full load to rebuild it.")
+
+    # Sort by game, then by event index within each data source, so every game is one continuous range of rows.
+    sort_columns = [column for column in ["dim_game_id", "sb_event_index", "opta_event_index"]
+                    if column in table.column_names]
+    table = table.sort_by([(column, "ascending") for column in sort_columns]).combine_chunks()
+
+    # First row and number of rows of each game.
+    game_ids = table["dim_game_id"].to_numpy()
+    unique_game_ids, game_starts, game_lengths = np.unique(game_ids, return_index=True, return_counts=True)
+    game_offsets = pa.table({"dim_game_id": unique_game_ids, "start": game_starts, "length": game_lengths})
+
+    # Game ids for each value of each index column, without duplicates.
+    index_tables = []
+    for column in [column for column in index_columns if column in table.column_names]:
+        pairs_df = pd.DataFrame({"value": table[column].to_numpy(zero_copy_only=False), "dim_game_id": game_ids})
+        pairs_df = pairs_df.dropna(subset=["value"]).drop_duplicates().sort_values(by=["value", "dim_game_id"])
+        index_tables.append(pa.table({"column": pa.array([column] * len(pairs_df), type=pa.string()),
+                                      "value": pa.array(pairs_df["value"].to_numpy(), type=pa.int64()),
+                                      "dim_game_id": pa.array(pairs_df["dim_game_id"].to_numpy(), type=pa.int64())}))
+    game_index = pa.concat_tables(index_tables) if index_tables else \
+                 pa.table({"column": pa.array([], type=pa.string()), "value": pa.array([], type=pa.int64()),
+                           "dim_game_id": pa.array([], type=pa.int64())})
+
+    # Write each file uncompressed, so that it can be memory mapped, then move it into place.
+    for file_key, file_table in [("table", table), ("game_offsets", game_offsets), ("game_index", game_index)]:
+        file_path = os.path.join(store_folder, SEQUENCE_STORE_FILES[file_key])
+        with pa.OSFile(file_path + ".tmp", "wb") as sink:
+            with pa.ipc.new_file(sink, file_table.schema) as writer:
+                writer.write_table(file_table)
+        os.replace(file_path + ".tmp", file_path)
+
+    # Calculate time it takes to write the store.
+    end_time = time.time()
+    print(f"{table.num_rows} rows for {len(unique_game_ids)} games written to sequence store '{store_folder}' "
+          f"in {(end_time - start_time) / 60} minutes.")
 
-    # Initiate empty df that all event dataframes will be appended to.
-    all_col_names = []
 
-    # Loop through each game id and extract its events.
-    for game_id in sb_game_ids:
-        events_df = sb.events(match_id=game_id)
-        for col_name in events_df.columns:
-            if col_name not in all_col_names:
-                all_col_names.append(col_name)
-                print(f"{col_name} from {game_id} added")
+def open_throw_in_sequence_store(store_folder):
+    """
+    :param   store_folder: Folder the store was written to by write_throw_in_sequence_store.
+    :return: store:        Dictionary with the memory mapped "table" of throw-ins, "game_offsets" of game id ->
+                           (first row, number of rows), and "game_index" of index column -> value -> array of game ids.
+    """
+    import pyarrow as pa
 
-    return all_col_names
+    def read_ipc_file(file_key):
+        return pa.ipc.open_file(pa.memory_map(os.path.join(store_folder, SEQUENCE_STORE_FILES[file_key]), "r")).read_all()
 
+    # The throw-ins are memory mapped, so only the rows that are looked up are read from disk.
+    table = read_ipc_file("table")
+
+    # The offsets and index are small, so they are loaded into dictionaries for fast lookups.
+    game_offsets_df = read_ipc_file("game_offsets").to_pandas()
+    game_offsets = dict(zip(game_offsets_df["dim_game_id"].tolist(),
+                            zip(game_offsets_df["start"].tolist(), game_offsets_df["length"].tolist())))
+
+    game_index = {}
+    game_index_df = read_ipc_file("game_index").to_pandas()
+    for (column, value), game_ids in game_index_df.groupby(["column", "value"], sort=False)["dim_game_id"]:
+        game_index.setdefault(column, {})[value] = game_ids.to_numpy()
+
+    return {"table": table, "game_offsets": game_offsets, "game_index": game_index}
 
-#%% Get all SB event column names.
 
-def get_sb_max_length_columns(dict_of_str_colnames):
+def select_throw_in_sequences(store, game_ids=None, as_pandas=True, **index_filters):
     """
-    :param   dict_of_str_colnames: Dictionary containing all string columns in SB event data with 0 length.
-    :return: dict_of_str_colnames: Updated dictionary with all the maximum characters that appeared for each column in the SB data.
+    :param   store:         Store opened with open_throw_in_sequence_store.
+    :param   game_ids:      List of game ids to select. All games matching index_filters are selected if None.
+    :param   as_pandas:     Return a pandas dataframe. If False, a pyarrow table of zero copy slices of the store is
+                            returned instead.
+    :param   index_filters: Index column = value filters, e.g. dim_team_id=12, dim_season_id=90. Games must match all of
+                            them.
+    :return: throw_ins:     All rows of the selected games, in order of game and event index. Filter on the row values,
+                            e.g. dim_team_id, to only keep one team's throw-ins.
     """
-    # Load in Statsbomb (SB) competition data.
-    sb_competitions = sb.competitions()
+    import pyarrow as pa
 
-    # Get a list of all unique competition + season ids in SB data.
-    comp_season_ids = SB_get_unique_competitions(sb_competitions_df=sb_competitions)
+    # Games that match every filter.
+    selected_game_ids = None if game_ids is None else set(game_ids)
+    for column, value in index_filters.items():
+        if column not in store["game_index"]:
+            raise ValueError(f"Column {column} is not indexed. Indexed columns = {list(store['game_index'])}")
+        column_game_ids = set(store["game_index"][column].get(value, np.array([], dtype="int64")).tolist())
+        selected_game_ids = column_game_ids if selected_game_ids is None else selected_game_ids & column_game_ids
 
-    # Get a list of tuples that include all the SB game ids, competition ids, season ids and modified date.
-    sb_game_tuples, sb_game_ids = SB_get_unique_games(comp_season_ids=comp_season_ids)
+    # No filters selects every game.
+    if selected_game_ids is None:
+        selected_game_ids = store["game_offsets"].keys()
 
-    # Loop through each game id and inspect its events.
-    for game_id in sb_game_ids:
-        events_df = sb.events(match_id=game_id)
-
-        # Loop through all SB str column names.
-        for column_name in dict_of_str_colnames:
-            # Sometimes a column name won't appear in every events dataframe.
-            if column_name in events_df.columns:
-                # Extract max length for column in specified events df.
-                str_lengths = [len(str(entry)) for entry in events_df[column_name]]
-                max_entry_length = max(str_lengths)
-                # max_entry_length = events_df[column_name].str.len().max()
-
-                # If this max length is greater than previously seen max lengths, it overwrites them.
-                if max_entry_length > dict_of_str_colnames[column_name]:
-                    dict_of_str_colnames[column_name] = max_entry_length
-                    print(f"Max {column_name} value found in {game_id}:length {dict_of_str_colnames[column_name]}")
+    # Each game is one continuous range of rows, so it is sliced from the table without copying.
+    slices = [store["table"].slice(*store["game_offsets"][game_id])
+              for game_id in sorted(selected_game_ids) if game_id in store["game_offsets"]]
+    throw_ins = pa.concat_tables(slices) if slices else store["table"].slice(0, 0)
 
-    return dict_of_str_colnames
+    return throw_ins.to_pandas() if as_pandas else throw_ins
 
 
-# all_SB_str_cols = {"type": 0, "player": 0, "position": 0, "team": 0, "possession_team": 0, "pass_body_part": 0, "pass_height": 0,
-#                    "pass_outcome": 0, "pass_recipient": 0, "pass_technique": 0, "pass_type": 0, "shot_body_part": 0, "shot_freeze_frame": 0,
-#                    "shot_outcome": 0, "shot_technique": 0, "shot_type": 0, "dribble_outcome": 0, "duel_outcome": 0, "duel_type": 0,
-#                    "foul_committed_card": 0, "foul_committed_type": 0, "clearance_body_part": 0, "goalkeeper_body_part": 0,
-#                    "goalkeeper_outcome": 0, "goalkeeper_position": 0, "goalkeeper_technique": 0, "goalkeeper_type": 0,
-#                    "substitution_outcome": 0, "substitution_replacement": 0, "bad_behaviour_card": 0, "ball_receipt_outcome": 0,
-#                    "50_50": 0, "interception_outcome": 0, "play_pattern": 0, "related_events": 0, "tactics": 0}
-# max_col_lengths = get_sb_max_length_columns(dict_of_str_colnames=all_SB_str_cols)
+#%% Keep aggregates of the metres gained on throw-ins by team, player, competition, season, pitch zone and home/away.
 
-#%% Drop columns that do not contain useful data.
+# Columns that have the same value for every throw-in in a game, so they are kept with every aggregate.
+CUBE_GAME_COLUMNS = ["dim_game_id", "dim_competition_id", "dim_season_id"]
 
-def drop_useless_columns(df):
+# Combinations of the other dimensions that aggregates are kept for. Queries use the smallest one that has all the
+# dimensions they ask for, along with any of the game columns.
+CUBE_GROUPING_SETS = [[], ["dim_team_id"], ["dim_player_id"], ["pitch_zone"], ["home_away"],
+                      ["dim_team_id", "dim_player_id"], ["dim_team_id", "pitch_zone"], ["dim_team_id", "home_away"]]
+
+# Width in metres of the histogram bins used to estimate quantiles. Quantiles are accurate to within one bin.
+CUBE_BIN_WIDTH = 0.5
+
+
+def add_cube_dimensions(throw_ins_df):
     """
-    :param   df: Pandas dataframe loaded from SQL database.
-    :return: df: Same dataframe as inputted, but with columns that contain only default values deleted.
+    :param   throw_ins_df: Pandas dataframe of throw-ins with the metres_gained column, e.g. Fact.Throw_Ins.
+    :return: throws_df:    Only the throw-ins that have metres gained, with pitch_zone (third of the pitch the throw was
+                           taken in, using SB coordinates) and home_away (if dim_home_team_id is in the data) columns.
     """
-    # Drop columns containing the substring 'meta'. ~ symbol corresponds with NOT.
-    df = df.loc[:, ~df.columns.str.contains('meta')]
+    # -1.0001 is the default for rows that aren't throw-ins, or that had no event before them to measure from.
+    metres_gained = throw_ins_df["metres_gained"].to_numpy(dtype=float, na_value=np.nan)
+    throws_df = throw_ins_df[~np.isnan(metres_gained) & ~np.isclose(metres_gained, -1.0001)].copy()
+
+    # x coordinate of the throw in SB coordinates. Opta throws have their coordinates converted already.
+    x_coord = np.full(len(throws_df), np.nan)
+    for column in ["converted_sb_x_coord", "sb_x_coord"]:
+        if column in throws_df.columns:
+            column_x_coord = throws_df[column].to_numpy(dtype=float, na_value=np.nan)
+            x_coord = np.where(column_x_coord >= 0, column_x_coord, x_coord)
+    throws_df["pitch_zone"] = pd.cut(x_coord, bins=[0, 40, 80, 120], labels=["Defensive third", "Middle third",
+                                                                            "Attacking third"],
+                                     include_lowest=True).astype(object)
+    throws_df["pitch_zone"] = throws_df["pitch_zone"].fillna("N/A")
 
-    # Initialise list of column names for columns that will be dropped.
-    drop_columns = []
+    if "dim_home_team_id" in throws_df.columns:
+        throws_df["home_away"] = np.where(throws_df["dim_team_id"].to_numpy() == throws_df["dim_home_team_id"].to_numpy(),
+                                          "Home", "Away")
 
-    # Loop through all column names for dataframe.
-    for column_name in df.columns:
-        # If all True/False columns are False, these columns should be dropped.
-        if df[column_name].dtype == bool and (df[column_name] == 0).all():
-            drop_columns.append(column_name)
+    return throws_df
 
-        # If all numeric columns are -1, these columns should be dropped.
-        elif df[column_name].dtype in ["int64", "float64"] and (df[column_name] == -1).all():
-            drop_columns.append(column_name)
 
-        # If all string (object when extracted from SQL) columns are N/A, these columns should be dropped.
-        elif df[column_name].dtype == "object" and (df[column_name] == "N/A").all():
-            drop_columns.append(column_name)
+def get_cube_aggregates(throws_df, group_columns, bin_width=CUBE_BIN_WIDTH):
+    """
+    :param   throws_df:     Throw-ins with cube dimensions, from add_cube_dimensions.
+    :param   group_columns: Columns to aggregate by.
+    :param   bin_width:     Width in metres of the histogram bins.
+    :return: aggregates_df: count, sum, sum of squares, min and max of metres_gained for each group, along with the
+                            histogram of metres_gained as a list of bins and a list of counts.
+    """
+    throws_df = throws_df[group_columns + ["metres_gained"]].copy()
+    throws_df["metres_gained"] = throws_df["metres_gained"].astype(float)
+    throws_df["metres_gained_squared"] = throws_df["metres_gained"] ** 2
+    throws_df["metres_bin"] = np.floor(throws_df["metres_gained"] / bin_width).astype("int64")
 
-    # Drop the identified columns
-    df.drop(columns=drop_columns, inplace=True)
+    # Categories would create a group for every combination of categories, rather than only the ones in the data.
+    grouped = throws_df.groupby(group_columns, observed=True, sort=False, dropna=False)
+    aggregates_df = grouped.agg(count=("metres_gained", "size"), sum=("metres_gained", "sum"),
+                                sum_of_squares=("metres_gained_squared", "sum"), min=("metres_gained", "min"),
+                                max=("metres_gained", "max")).reset_index()
 
-    return df
+    # Histogram of each group, stored sparsely as the bins that have throws and the number of throws in them.
+    histogram_df = throws_df.groupby(group_columns + ["metres_bin"], observed=True, dropna=False).size()\
+                            .rename("bin_count").reset_index()
+    histogram_df = histogram_df.groupby(group_columns, observed=True, sort=False, dropna=False)\
+                               .agg(bins=("metres_bin", list), bin_counts=("bin_count", list)).reset_index()
 
+    aggregates_df = aggregates_df.merge(histogram_df, on=group_columns, how="left")
 
-#%% Convert coordinates from Opta to Statsbomb or vice-versa.
+    return aggregates_df
 
-def convert_coords(value, input_data_source, output_data_source, x_or_y):
+
+def update_metres_stolen_cube(throw_ins_df, cube_folder, replace_game_ids=None, bin_width=CUBE_BIN_WIDTH):
     """
-    :param value:              Value that will be converted, can be integer/float or pandas column.
-    :param input_data_source:  Source where inputted value comes from, can be "Statsbomb" or "Opta".
-    :param output_data_source: What outputted value's data source should be, can be "Statsbomb" or "Opta".
-    :param x_or_y:             Converting x or y coordinates. Different pitch dimensions for length and width.
-    :return:
+    :param   throw_ins_df:     Pandas dataframe of throw-ins with the metres_gained column, e.g. Fact.Throw_Ins.
+    :param   cube_folder:      Folder the aggregates are saved in, one parquet file per grouping set.
+    :param   replace_game_ids: List of game ids that throw_ins_df replaces in the existing aggregates, for incremental
+                               loads. All aggregates are rebuilt from throw_ins_df if None.
+    :param   bin_width:        Width in metres of the histogram bins. Must match the existing aggregates.
+    :return: Aggregates per game for every grouping set in CUBE_GROUPING_SETS whose columns are in the data. Aggregates
+             are kept per game so that changed games can be replaced.
     """
-    if input_data_source == "Opta" and output_data_source == "Statsbomb":
-        # Length of Opta pitch is 100, SB is 120. Multiply by (120/100) = (6/5) = 1.2
-        if x_or_y == "x":
-            converted_value = value * (6 / 5)
+    # Initialise start time to see how long it takes to update the aggregates.
+    start_time = time.time()
 
-        # Width of Opta pitch is 100, SB is 80. Multiply by (80/100) = (4/5) = 0.8
-        elif x_or_y == "y":
-            converted_value = value * (4 / 5)
+    os.makedirs(cube_folder, exist_ok=True)
+    metadata_path = os.path.join(cube_folder, "cube.json")
 
-        else:
-            print("Conversion only available for x and y coordinates.")
-            return
+    # Aggregates can only be combined if they were made with the same bins.
+    if replace_game_ids is not None and os.path.exists(metadata_path):
+        with open(metadata_path, "r") as metadata_file:
+            existing_bin_width = json.load(metadata_file)["bin_width"]
+        if existing_bin_width != bin_width:
+            raise ValueError(f"Aggregates in '{cube_folder}' use {existing_bin_width} metre bins, not {bin_width}. "
+                             f"Rebuild them with a full load.")
 
-    elif input_data_source == "Statsbomb" and output_data_source == "Opta":
-        # Length of SB pitch is 120, Opta is 100. Multiply by (100/120) = (5/6) = 0.833
-        if x_or_y == "x":
-            converted_value = value * (5 / 6)
+    throws_df = add_cube_dimensions(throw_ins_df)
+    game_columns = [column for column in CUBE_GAME_COLUMNS if column in throws_df.columns]
 
-        # Width of SB pitch is 80, Opta is 100. Multiply by (100/80) = (5/4) = 1.25
-        elif x_or_y == "y":
-            converted_value = value * (5 / 4)
+    grouping_sets = []
+    for grouping_set in CUBE_GROUPING_SETS:
+        if not all(column in throws_df.columns for column in grouping_set):
+            continue
 
-        else:
-            print("Conversion only available for x and y coordinates.")
-            return
+        aggregates_df = get_cube_aggregates(throws_df=throws_df, group_columns=game_columns + grouping_set,
+                                            bin_width=bin_width)
 
-    else:
-        print("Converting only valid from Opta to SB and vice-versa.")
-        return
+        # Keep the aggregates of the games that haven't changed.
+        aggregates_path = os.path.join(cube_folder, f"{'__'.join(grouping_set) or 'all'}.parquet")
+        if replace_game_ids is not None and os.path.exists(aggregates_path):
+            existing_df = pd.read_parquet(aggregates_path)
+            existing_df = existing_df[~existing_df["dim_game_id"].isin(replace_game_ids)]
+            aggregates_df = pd.concat([existing_df, aggregates_df], ignore_index=True)
 
-    return converted_value
+        aggregates_df.to_parquet(aggregates_path + ".tmp", index=False)
+        os.replace(aggregates_path + ".tmp", aggregates_path)
+        grouping_sets.append(grouping_set)
+
+    with open(metadata_path, "w") as metadata_file:
+        json.dump({"bin_width": bin_width, "game_columns": game_columns, "grouping_sets": grouping_sets},
+                  metadata_file, indent=2)
+
+    # Calculate time it takes to update the aggregates.
+    end_time = time.time()
+    print(f"Aggregates of {len(throws_df)} throws for {len(grouping_sets)} grouping sets saved in '{cube_folder}' "
+          f"in {(end_time - start_time) / 60} minutes.")
 
 
+def get_quantile_from_histogram(bins, bin_counts, quantile, bin_width):
+    """
+    :param   bins:       Array of histogram bin numbers. Bin b holds values from b * bin_width to (b + 1) * bin_width.
+    :param   bin_counts: Array of the number of values in each bin.
+    :param   quantile:   Quantile to estimate, between 0 and 1.
+    :param   bin_width:  Width of the bins.
+    :return: value:      Estimated quantile, interpolated within the bin it falls in.
+    """
+    order = np.argsort(bins)
+    bins, bin_counts = bins[order], bin_counts[order]
+    cumulative_counts = np.cumsum(bin_counts)
+    target = quantile * cumulative_counts[-1]
+
+    # Bin the quantile falls in, and how far through that bin it is.
+    position = min(np.searchsorted(cumulative_counts, target, side="left"), len(bins) - 1)
+    previous_count = cumulative_counts[position - 1] if position > 0 else 0
+    fraction = (target - previous_count) / bin_counts[position]
+
+    return (bins[position] + fraction) * bin_width
+
+
+def query_metres_stolen_cube(cube_folder, by, filters=None, quantiles=(0.25, 0.5, 0.75)):
+    """
+    :param   cube_folder: Folder the aggregates were saved in by update_metres_stolen_cube.
+    :param   by:          List of dimensions to group by, e.g. ["dim_team_id", "dim_season_id"]. [] gives one row.
+    :param   filters:     Dictionary of dimension -> value or list of values to include, e.g. {"dim_season_id": 90}.
+    :param   quantiles:   Quantiles of metres_gained to estimate from the histograms.
+    :return: results_df:  Number of throws, mean, sample standard deviation (as pandas .std(), NaN for a single throw),
+                          min, max and quantiles of metres_gained for each group.
+    """
+    with open(os.path.join(cube_folder, "cube.json"), "r") as metadata_file:
+        metadata = json.load(metadata_file)
+
+    # Use the smallest grouping set that has every dimension that is grouped by or filtered on.
+    dimensions = [column for column in list(by) + list(filters or {}) if column not in metadata["game_columns"]]
+    matching_sets = [grouping_set for grouping_set in metadata["grouping_sets"]
+                     if all(column in grouping_set for column in dimensions)]
+    if not matching_sets:
+        raise ValueError(f"No aggregates are kept for dimensions {dimensions}. "
+                         f"Grouping sets = {metadata['grouping_sets']}")
+    grouping_set = min(matching_sets, key=len)
+    aggregates_df = pd.read_parquet(os.path.join(cube_folder, f"{'__'.join(grouping_set) or 'all'}.parquet"))
+
+    # Only keep the aggregates that match the filters.
+    for column, value in (filters or {}).items():
+        aggregates_df = aggregates_df[aggregates_df[column].isin(value if isinstance(value, list) else [value])]
+
+    # Combine the aggregates of each group. Counts, sums and sums of squares add up, and histograms are added bin by bin.
+    group_keys = list(by) if by else np.zeros(len(aggregates_df), dtype="int64")
+    grouped = aggregates_df.groupby(group_keys, sort=True, dropna=False)
+    results_df = grouped.agg(count=("count", "sum"), sum=("sum", "sum"), sum_of_squares=("sum_of_squares", "sum"),
+                             min=("min", "min"), max=("max", "max"))
+    results_df["mean"] = results_df["sum"] / results_df["count"]
+    # Sample standard deviation (n - 1), the same as pandas .std(). Groups with one throw have no standard deviation.
+    squared_deviations = np.maximum(results_df["sum_of_squares"] - results_df["count"] * results_df["mean"] ** 2, 0)
+    results_df["std"] = np.sqrt(squared_deviations / (results_df["count"] - 1).where(results_df["count"] > 1))
+
+    # Number of each group, in the same order as results_df.
+    histograms_df = aggregates_df[["bins", "bin_counts"]].assign(group=grouped.ngroup().to_numpy())
+    histograms_df = histograms_df.explode(["bins", "bin_counts"]).astype({"bins": "int64", "bin_counts": "int64"})
+    histograms_df = histograms_df.groupby(["group", "bins"])["bin_counts"].sum().reset_index()
+
+    # Interpolating within a bin can go past the smallest or largest throw, so quantiles are kept between them.
+    for quantile in quantiles:
+        quantile_values = [get_quantile_from_histogram(bins=group_df["bins"].to_numpy(),
+                                                       bin_counts=group_df["bin_counts"].to_numpy(),
+                                                       quantile=quantile, bin_width=metadata["bin_width"])
+                           for _, group_df in histograms_df.groupby("group", sort=True)]
+        results_df[f"p{round(quantile * 100)}"] = np.clip(quantile_values, results_df["min"].to_numpy(),
+                                                          results_df["max"].to_numpy())
+
+    results_df = results_df.drop(columns=["sum", "sum_of_squares"])
+    results_df = results_df.reset_index(drop=not by)
+
+    return results_df
@@ -0,0 +1,721 @@
+#%% Imports.
+import sys
+import os
+import json
+import time
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import Custom_Functions as func
+
+# Columns of Fact.Throw_Ins that are GUIDs. These appear as objects/strings in Python.
+GUID_COLUMNS = ["sb_event_id", "sb_pass_assisted_shot_id", "sb_shot_key_pass_id"]
+
+# Tables that Fact.Throw_Ins is built from.
+SOURCE_TABLES = [("Fact", "SB_Throw_Ins"), ("Fact", "Opta_Throw_Ins")]
+
+# Data source of each of the tables that Fact.Throw_Ins is built from.
+SOURCE_DATA_SOURCES = {"SB_Throw_Ins": "Statsbomb", "Opta_Throw_Ins": "Opta"}
+
+# Stages whose output is saved as a checkpoint, so that a failed run can resume from them.
+CHECKPOINT_STAGES = ["load", "drop_useless_columns", "transform_throw_ins", "merge"]
+
+
+#%% Keep the state of each load, so that the next incremental load knows which source changes it has already processed.
+
+def load_load_state(load_state_path):
+    """
+    :param   load_state_path: Path of JSON file the load state is saved in.
+    :return: load_state:      Dictionary of target -> {"watermark", "game_ids"}. Empty if it hasn't been saved yet.
+    """
+    if load_state_path is None or not os.path.exists(load_state_path):
+        return {}
+
+    with open(load_state_path) as load_state_file:
+        return json.load(load_state_file)
+
+
+def save_load_state(load_state, load_state_path):
+    """
+    :param   load_state:      Dictionary of target -> {"watermark", "game_ids"}.
+    :param   load_state_path: Path of JSON file the load state is saved in. Not saved if None.
+    :return:                  Load state is saved as JSON.
+    """
+    if load_state_path is None:
+        return
+
+    with open(load_state_path, "w") as load_state_file:
+        json.dump(load_state, load_state_file, indent=4)
+
+
+def get_sql_server_time(engine):
+    """
+    :param   engine:      SQL alchemy engine.
+    :return: server_time: Current time on SQL server, which is the clock that the source validity columns are set by.
+    """
+    return pd.read_sql_query(sql="SELECT GETDATE() AS server_time", con=engine)["server_time"][0]
+
+
+def get_source_game_ids(engine, source_tables):
+    """
+    :param   engine:          SQL alchemy engine.
+    :param   source_tables:   List of (schema, table name) tuples for the tables Fact.Throw_Ins is built from.
+    :return: source_game_ids: Sorted list of game ids that have current rows in any of the source tables.
+    """
+    source_game_ids = set()
+    for source_schema, source_name in source_tables:
+        game_ids_df = pd.read_sql_query(sql=f"SELECT DISTINCT dim_game_id FROM [{source_schema}].[{source_name}] "
+                                            f"WHERE meta_is_current = 1",
+                                        con=engine)
+        source_game_ids.update(game_ids_df["dim_game_id"].tolist())
+
+    return sorted(source_game_ids)
+
+
+def get_target_load_state(engine, target_schema, target_name):
+    """
+    :param   engine:        SQL alchemy engine.
+    :param   target_schema: Schema of the table that is loaded incrementally.
+    :param   target_name:   Name of the table that is loaded incrementally.
+    :return: target_state:  {"watermark", "game_ids"} worked out from the target table, for tables loaded before the load
+                            state was saved. The watermark is the last time the table was written to.
+    """
+    last_load_time = pd.read_sql_query(sql=f"SELECT MAX(meta_row_modified) AS last_load_time "
+                                           f"FROM [{target_schema}].[{target_name}]",
+                                       con=engine)["last_load_time"][0]
+    game_ids_df = pd.read_sql_query(sql=f"SELECT DISTINCT dim_game_id FROM [{target_schema}].[{target_name}] "
+                                        f"WHERE meta_is_current = 1",
+                                    con=engine)
+
+    return {"watermark": None if pd.isna(last_load_time) else str(last_load_time),
+            "game_ids": sorted(game_ids_df["dim_game_id"].tolist())}
+
+
+#%% Find games that are new or have changed since Fact.Throw_Ins was last loaded.
+
+def get_changed_game_ids(engine, source_tables, target_schema, target_name, target_states, source_game_ids):
+    """
+    :param engine:            SQL alchemy engine.
+    :param source_tables:     List of (schema, table name) tuples for the tables Fact.Throw_Ins is built from.
+    :param target_schema:     Schema of the table that is loaded incrementally.
+    :param target_name:       Name of the table that is loaded incrementally.
+    :param target_states:     Dictionary of output (Fact.Throw_Ins, the sequence store and the aggregates) ->
+                              {"watermark", "game_ids"} saved by the last load that updated it, see load_load_state.
+                              Outputs with None are assumed to be as up to date as the target table.
+    :param source_game_ids:   List of game ids that currently have rows in the source tables.
+    :return: changed_game_ids: List of game ids that need to be recomputed for any of the outputs. None if the target
+                               table doesn't exist yet.
+    """
+    # If the target table doesn't exist yet, a full load is needed.
+    table_exists = pd.read_sql_query(sql=f"SELECT OBJECT_ID('{target_schema}.{target_name}') AS object_id",
+                                     con=engine)["object_id"][0]
+    if pd.isna(table_exists):
+        print(f"Table '{target_schema}.{target_name}' does not exist, so a full load is needed.")
+        return None
+
+    # Outputs loaded before the load state was saved.
+    if any(target_state is None for target_state in target_states.values()):
+        print(f"No load state saved for {[target for target, state in target_states.items() if state is None]}, "
+              f"so it is worked out from '{target_schema}.{target_name}'.")
+        table_state = get_target_load_state(engine=engine, target_schema=target_schema, target_name=target_name)
+        target_states = {target: target_state or table_state for target, target_state in target_states.items()}
+
+    # Games in the source that an output has never processed, including games that have no throw-ins.
+    changed_game_ids = set()
+    for target_state in target_states.values():
+        changed_game_ids.update(set(source_game_ids) - set(target_state["game_ids"]))
+
+    # Games that have rows added or expired in the source since the earliest output was last loaded. Expired rows are
+    # included so that games removed from the source are also expired in the target. Rows stamped at the watermark
+    # itself are included, as recomputing a game twice is harmless but missing it isn't.
+    watermarks = [target_state["watermark"] for target_state in target_states.values()
+                  if target_state["watermark"] is not None]
+    watermark = min(watermarks, key=pd.Timestamp) if watermarks else None
+    if watermark is not None:
+        for source_schema, source_name in source_tables:
+            input_query = f"""SELECT DISTINCT dim_game_id FROM [{source_schema}].[{source_name}]
+                              WHERE meta_valid_from >= ?
+                              OR (meta_is_current = 0 AND meta_valid_to >= ?)"""
+            watermark_param = pd.Timestamp(watermark).to_pydatetime()
+            source_game_ids_df = pd.read_sql_query(sql=input_query, con=engine, params=[watermark_param, watermark_param])
+            changed_game_ids.update(source_game_ids_df["dim_game_id"].tolist())
+
+    changed_game_ids = sorted(changed_game_ids)
+    print(f"{len(changed_game_ids)} new or changed games since {watermark}.")
+
+    return changed_game_ids
+
+
+#%% Load SB and Opta throw-ins from SQL server or parquet.
+
+def load_source_throw_ins(engine, storage_backend, load_mode, changed_game_ids=None, parquet_folder="data",
+                          sql_window_pushdown=False, sql_skip_useless_columns=False):
+    """
+    :param engine:                   SQL alchemy engine. Not used for parquet storage.
+    :param storage_backend:          "sql" or "parquet".
+    :param load_mode:                "full" loads every game. "incremental" only loads the games in changed_game_ids.
+    :param changed_game_ids:         List of game ids to load for incremental loads.
+    :param parquet_folder:           Folder containing the parquet datasets. Only used for parquet storage.
+    :param sql_window_pushdown:      Only load throw-ins and the event before them from SQL server, filtered on the
+                                     server, instead of extracting them in Python. Only used for SQL storage.
+    :param sql_skip_useless_columns: Check on SQL server which columns only contain default values, and don't load
+                                     them. Only used for SQL storage.
+    :return: fact_sb_throw_ins, fact_opta_throw_ins: Pandas dataframes of the SB and Opta throw-ins.
+    """
+    # Load one table from parquet, or from SQL server in full or for the changed games only.
+    def load_table(table_name):
+        if storage_backend == "parquet":
+            return func.select_parquet_table(dataset_folder=parquet_folder, table_schema="Fact", table_name=table_name)
+
+        throw_in_window = SOURCE_DATA_SOURCES[table_name] if sql_window_pushdown else None
+
+        # Columns that only contain default values are dropped after loading anyway. For incremental loads, the range of
+        # changed games is checked, as SQL server allows at most 2100 parameters per query.
+        columns = None
+        if sql_skip_useless_columns:
+            columns = func.get_sql_useful_columns(engine=engine, table_schema="Fact", table_name=table_name,
+                                                  filters=None if load_mode == "full" else
+                                                  {"dim_game_id": (min(changed_game_ids), max(changed_game_ids))})
+
+        if load_mode == "full":
+            return func.select_sql_table(table_schema="Fact", table_name=table_name, connection=engine,
+                                         columns=columns, throw_in_window=throw_in_window)
+
+        # Only load the changed games. Games are loaded in batches as SQL server allows at most 2100 parameters per query.
+        game_id_batches = [changed_game_ids[i:i + 2000] for i in range(0, len(changed_game_ids), 2000)]
+        return pd.concat([func.select_sql_table(table_schema="Fact", table_name=table_name, connection=engine,
+                                                columns=columns, filters={"dim_game_id": game_id_batch},
+                                                throw_in_window=throw_in_window)
+                          for game_id_batch in game_id_batches], ignore_index=True)
+
+    # Load both tables at the same time. Each load uses its own connection from the engine's pool.
+    with ThreadPoolExecutor(max_workers=len(SOURCE_TABLES)) as executor:
+        fact_sb_throw_ins, fact_opta_throw_ins = executor.map(load_table, [table_name for _, table_name in SOURCE_TABLES])
+
+    return fact_sb_throw_ins, fact_opta_throw_ins
+
+
+#%% Create table in SQL and fill with data.
+
+def create_throw_ins_table_in_sql(engine, table_schema, table_name, throw_ins_df, guid_columns, registry_path,
+                                  sb_event_schema_path=None, insert_options=None):
+    """
+    :param engine:               SQL alchemy engine.
+    :param table_schema:         Schema of table you want to create in SQL.
+    :param table_name:           Name of table you want to create in SQL.
+    :param throw_ins_df:         Pandas dataframe that you want to insert in SQL.
+    :param guid_columns:         List of columns that are GUIDs. Need to specify these as they appear as objects/strings.
+    :param registry_path:        Path of JSON file that the table's column datatypes are saved in between loads.
+    :param sb_event_schema_path: JSON file written by func.SB_profile_event_schema. SB string columns are sized for the
+                                 longest value in all SB events. Only the lengths in this load are used if None.
+    :param insert_options:       Dictionary of keyword arguments for func.bulk_insert_dataframe (method, batch_size,
+                                 fast_executemany, staging_folder, data_source). Its defaults are used if None.
+    :return:                     Table is created in SQL database.
+    """
+    # Initialise start time to see how long it takes to delete rows.
+    start_time = time.time()
+
+    # Convert compact datatypes back to the datatypes used for SQL.
+    throw_ins_df = func.restore_sql_dtypes(df=throw_ins_df, guid_columns=guid_columns)
+
+    # Update the saved column datatypes with this data. NVARCHAR lengths never shrink below lengths seen in earlier loads.
+    schema_registry = func.load_sql_schema_registry(registry_path=registry_path) or {}
+    schema_registry, _ = func.update_sql_schema_registry(schema_registry=schema_registry, df=throw_ins_df,
+                                                         guid_columns=guid_columns)
+
+    # Size the SB string columns for every SB event, so that loading other competitions doesn't need to widen them.
+    if sb_event_schema_path is not None:
+        sb_event_schema = func.SB_load_event_schema(schema_path=sb_event_schema_path)
+        schema_registry = func.add_sb_event_schema_to_registry(schema_registry=schema_registry,
+                                                               sb_event_schema=sb_event_schema)
+
+    # Datatypes of all the columns. This is to ensure that each column is correctly defined in the SQL server.
+    data_types = {column: func.get_sql_column_type(schema_registry[column]) for column in throw_ins_df.columns}
+
+    # Drop the table if it is already in the SQL database.
+    engine.execute(f"DROP TABLE IF EXISTS {table_schema}.{table_name}")
+
+    # Create the SQL table with specified columns and data types, along with meta columns.
+    create_table_query = func.build_create_table_query(table_schema=table_schema, table_name=table_name,
+                                                       data_types=data_types)
+    engine.execute(create_table_query)
+
+    # Insert the DataFrame into the SQL database.
+    func.bulk_insert_dataframe(df=throw_ins_df, engine=engine, table_schema=table_schema, table_name=table_name,
+                               **(insert_options or {}))
+    print(f"Table '{table_schema}.{table_name}' created successfully.")
+
+    # Save the column datatypes for the next load.
+    func.save_sql_schema_registry(schema_registry=schema_registry, registry_path=registry_path)
+
+    # Calculate time it takes to create table and insert data.
+    end_time = time.time()
+    print(f"Time taken to create table and insert data: {(end_time - start_time) / 60} minutes.")
+
+
+#%% Merge new and changed games into the existing SQL table.
+
+def merge_throw_ins_into_sql_table(engine, table_schema, table_name, throw_ins_df, changed_game_ids, guid_columns,
+                                   registry_path, insert_options=None):
+    """
+    :param engine:           SQL alchemy engine.
+    :param table_schema:     Schema of the existing table in SQL.
+    :param table_name:       Name of the existing table in SQL.
+    :param throw_ins_df:     Pandas dataframe containing the recomputed throw-ins for the changed games.
+    :param changed_game_ids: List of game ids that were recomputed.
+    :param guid_columns:     List of columns that are GUIDs. Need to specify these as they appear as objects/strings.
+    :param registry_path:    Path of JSON file that the table's column datatypes are saved in between loads.
+    :param insert_options:   Dictionary of keyword arguments for func.bulk_insert_dataframe (method, batch_size,
+                             fast_executemany, staging_folder, data_source). Its defaults are used if None.
+    :return:                 Current rows for the changed games are expired and the recomputed rows are inserted.
+    """
+    # Initialise start time to see how long it takes to merge the data.
+    start_time = time.time()
+
+    # Convert compact datatypes back to the datatypes used for SQL.
+    throw_ins_df = func.restore_sql_dtypes(df=throw_ins_df, guid_columns=guid_columns)
+
+    staging_table_name = f"{table_name}_Staging"
+    staging_games_table_name = f"{table_name}_Staging_Games"
+
+    # Update the saved column datatypes with the new data. If they haven't been saved, use the existing table's datatypes.
+    schema_registry = func.load_sql_schema_registry(registry_path=registry_path) or \
+                      func.get_sql_schema_registry_from_table(engine=engine, table_schema=table_schema, table_name=table_name)
+    schema_registry, changed_columns = func.update_sql_schema_registry(schema_registry=schema_registry, df=throw_ins_df,
+                                                                       guid_columns=guid_columns)
+
+    # Columns in the existing table, apart from the meta columns that are filled in by SQL defaults.
+    column_types = pd.read_sql_query(sql=f"""SELECT COLUMN_NAME, DATA_TYPE FROM INFORMATION_SCHEMA.COLUMNS
+                                             WHERE TABLE_SCHEMA = '{table_schema}' AND TABLE_NAME = '{table_name}'
+                                             AND COLUMN_NAME NOT IN ('meta_row_modified', 'meta_valid_from', 'meta_valid_to')""",
+                                     con=engine)
+    column_types = dict(zip(column_types["COLUMN_NAME"], column_types["DATA_TYPE"]))
+    existing_columns = list(column_types)
+
+    # Columns of the new data that aren't in the table yet. This is checked against the table itself rather than the
+    # registry, as the registry can hold columns that were never written (e.g. from the SB event schema).
+    new_columns = [column for column in throw_ins_df.columns if column not in existing_columns]
+
+    # Widen columns that have wider datatypes or longer values than before, and add columns that have data for the first
+    # time. A default bound to a column would block ALTER COLUMN, so any default is dropped first, and new columns are
+    # added without one. Existing rows get the default value for new columns. {table} is filled in with the staging or
+    # existing table.
+    alter_queries = {}
+    for column in [column for column in changed_columns if column in existing_columns] + new_columns:
+        column_type = func.get_sql_column_type(schema_registry[column])
+        if column in existing_columns:
+            alter_queries[column] = [func.build_drop_default_constraint_query(table="{table}", column=column),
+                                     f"ALTER TABLE {{table}} ALTER COLUMN {column} {column_type}"]
+        else:
+            alter_queries[column] = [f"ALTER TABLE {{table}} ADD {column} {column_type} NULL"]
+            default_value = func.get_sql_default_value(schema_registry[column])
+            if default_value is not None:
+                alter_queries[column].append(f"UPDATE {{table}} SET {column} = {default_value}")
+        column_types[column] = schema_registry[column]["sql_type"].lower()
+
+    # Columns that only contain default values for the changed games were dropped, so add them back with default values.
+    # Every column of the new data is in column_types, so none are dropped.
+    throw_ins_df = throw_ins_df.reindex(columns=list(column_types))
+    for column, sql_type in column_types.items():
+        if sql_type == "uniqueidentifier" or column in guid_columns:
+            throw_ins_df[column] = throw_ins_df[column].fillna('00000000-0000-0000-0000-000000000000')
+        elif sql_type in ["nvarchar", "varchar"]:
+            throw_ins_df[column] = throw_ins_df[column].fillna('N/A')
+        elif sql_type == "bit":
+            throw_ins_df[column] = throw_ins_df[column].fillna(0).astype(bool)
+        else:
+            throw_ins_df[column] = throw_ins_df[column].fillna(-1)
+
+    # Create empty staging tables with the same columns as the existing table, widened in the same way, and fill them.
+    engine.execute(f"DROP TABLE IF EXISTS {table_schema}.{staging_table_name}")
+    engine.execute(f"SELECT TOP 0 {', '.join(existing_columns)} INTO {table_schema}.{staging_table_name} "
+                   f"FROM {table_schema}.{table_name}")
+    for column_alter_queries in alter_queries.values():
+        for alter_query in column_alter_queries:
+            engine.execute(alter_query.format(table=f"{table_schema}.{staging_table_name}"))
+    func.bulk_insert_dataframe(df=throw_ins_df, engine=engine, table_schema=table_schema, table_name=staging_table_name,
+                               **(insert_options or {}))
+    pd.DataFrame({"dim_game_id": changed_game_ids}).to_sql(staging_games_table_name, engine, schema=table_schema,
+                                                           if_exists="replace", index=False)
+
+    # Widen the existing table, expire the current rows for the changed games and insert the recomputed rows in one
+    # transaction, so a failed merge leaves the table as it was. meta_row_modified, meta_valid_from and meta_valid_to are
+    # filled in by the table's defaults.
+    columns_str = ', '.join(column_types)
+    with engine.begin() as connection:
+        for column, column_alter_queries in alter_queries.items():
+            for alter_query in column_alter_queries:
+                connection.execute(alter_query.format(table=f"{table_schema}.{table_name}"))
+            print(f"Column {column} in '{table_schema}.{table_name}' {'altered to' if column in existing_columns else 'added as'} "
+                  f"{func.get_sql_column_type(schema_registry[column])}.")
+        connection.execute(f"UPDATE {table_schema}.{table_name} "
+                           f"SET meta_is_current = 0, meta_valid_to = getdate(), meta_row_modified = getdate() "
+                           f"WHERE meta_is_current = 1 "
+                           f"AND dim_game_id IN (SELECT dim_game_id FROM {table_schema}.{staging_games_table_name})")
+        connection.execute(f"INSERT INTO {table_schema}.{table_name} ({columns_str}) "
+                           f"SELECT {columns_str} FROM {table_schema}.{staging_table_name}")
+
+    # Drop the staging tables.
+    engine.execute(f"DROP TABLE IF EXISTS {table_schema}.{staging_table_name}")
+    engine.execute(f"DROP TABLE IF EXISTS {table_schema}.{staging_games_table_name}")
+    print(f"{len(throw_ins_df)} rows for {len(changed_game_ids)} games merged into '{table_schema}.{table_name}'.")
+
+    # Save the column datatypes for the next load.
+    func.save_sql_schema_registry(schema_registry=schema_registry, registry_path=registry_path)
+
+    # Calculate time it takes to merge the data.
+    end_time = time.time()
+    print(f"Time taken to merge data: {(end_time - start_time) / 60} minutes.")
+
+
+#%% Get the state of the source tables, so that checkpoints are only resumed from if the source data hasn't changed.
+
+def get_source_tables_state(engine, storage_backend, parquet_folder="data"):
+    """
+    :param engine:          SQL alchemy engine. Not used for parquet storage.
+    :param storage_backend: "sql" or "parquet".
+    :param parquet_folder:  Folder containing the parquet datasets. Only used for parquet storage.
+    :return: source_state:  Dictionary of table name -> row count and last change time for SQL tables, or the names,
+                            sizes and modified times of the files in each parquet dataset.
+    """
+    source_state = {}
+    for table_schema, table_name in SOURCE_TABLES:
+        if storage_backend == "parquet":
+            dataset_path = os.path.join(parquet_folder, table_schema, table_name)
+            source_state[table_name] = sorted([(os.path.relpath(os.path.join(folder, file_name), dataset_path),
+                                                os.path.getsize(os.path.join(folder, file_name)),
+                                                os.path.getmtime(os.path.join(folder, file_name)))
+                                               for folder, _, file_names in os.walk(dataset_path)
+                                               for file_name in file_names])
+
+        else:
+            # Rows are added with a new meta_valid_from, and expired with a new meta_valid_to.
+            state_df = pd.read_sql_query(sql=f"""SELECT COUNT(*) AS row_count,
+                                                 MAX(meta_valid_from) AS last_valid_from,
+                                                 MAX(CASE WHEN meta_is_current = 0 THEN meta_valid_to END) AS last_expired
+                                                 FROM [{table_schema}].[{table_name}]""",
+                                         con=engine)
+            source_state[table_name] = state_df.iloc[0].astype(str).to_dict()
+
+    return source_state
+
+
+#%% Run the whole pipeline.
+
+def run_throw_ins_pipeline(load_mode="incremental", storage_backend="sql", engine=None, sql_config_path=None,
+                           sql_echo=False, sql_window_pushdown=False, sql_skip_useless_columns=False,
+                           schema_registry_path="Fact.Throw_Ins.schema.json",
+                           load_state_path="Fact.Throw_Ins.load_state.json", sb_event_schema_path=None,
+                           sequence_store_folder="throw_ins_store",
+                           cube_folder="throw_ins_cube", parquet_folder="data",
+                           parquet_partition_columns=("dim_competition_id", "dim_season_id"), parallel_workers=1,
+                           stage_metrics_path="stage_metrics.jsonl", checkpoint_folder="checkpoints",
+                           insert_method="executemany", insert_batch_size=50000, fast_executemany=None,
+                           insert_staging_folder=None, insert_data_source=None):
+    """
+    :param load_mode:                 "full" drops and recreates Fact.Throw_Ins. "incremental" only recomputes games that
+                                      are new or changed since the last load.
+    :param storage_backend:           "sql" reads from and writes to SQL server. "parquet" reads from and writes to
+                                      parquet datasets in parquet_folder, so no database is needed.
+    :param engine:                    SQL alchemy engine. If None, the shared engine for the settings in
+                                      sql_config_path/environment variables is used.
+    :param sql_config_path:           JSON file with the SQL connection settings, see func.get_sql_connection_settings.
+    :param sql_echo:                  Log every SQL statement sent to the server.
+    :param sql_window_pushdown:       Extract throw-ins and the event before them on SQL server with window functions,
+                                      so that only those rows are downloaded. Gives the same rows as extracting them in
+                                      Python. Only used for SQL storage.
+    :param sql_skip_useless_columns:  Check on SQL server which columns only contain default values, and don't
+                                      download them. Only used for SQL storage.
+    :param schema_registry_path:      JSON file that Fact.Throw_Ins column datatypes are saved in between loads.
+    :param load_state_path:           JSON file that the start time of the last load of Fact.Throw_Ins, the sequence
+                                      store and the aggregates, and the games each processed, are saved in. Incremental
+                                      loads recompute the games changed since the earliest of them. Only used for SQL
+                                      storage.
+    :param sb_event_schema_path:      JSON file written by func.SB_profile_event_schema. Full loads size the SB string
+                                      columns for the longest value in all SB events. Not used if None.
+    :param sequence_store_folder:     Folder that the throw-ins are also written to, sorted by game and indexed by team
+                                      and player, for fast lookups with func.select_throw_in_sequences. Not written if
+                                      None.
+    :param cube_folder:               Folder that aggregates of metres_gained by team, player, competition, season, pitch
+                                      zone and home/away are kept in, for func.query_metres_stolen_cube. Not kept if None.
+    :param parquet_folder:            Folder containing the parquet datasets. Only used for parquet storage.
+    :param parquet_partition_columns: Columns that the parquet dataset of Fact.Throw_Ins is partitioned by.
+    :param parallel_workers:          Number of worker processes the per-game transforms are split between.
+                                      1 runs them in this process.
+    :param stage_metrics_path:        JSON lines file that the time, CPU time, memory and row count of each stage are
+                                      added to. Not written if None.
+    :param checkpoint_folder:         Folder that the output of each stage up to the merge is saved in. If a run fails,
+                                      the next run resumes from the last stage whose inputs haven't changed. Removed
+                                      once the run finishes. No checkpoints are saved if None.
+    :param insert_method:             How rows are inserted into SQL server: "executemany", "values" or "bulk_insert".
+                                      See func.bulk_insert_dataframe. Only used for SQL storage.
+    :param insert_batch_size:         Maximum number of rows sent to SQL server in each batch. All batches are
+                                      committed together.
+    :param fast_executemany:          Send each "executemany" batch as one array of parameters. If None, the engine's
+                                      setting is used, which is only on for localhost.
+    :param insert_staging_folder:     Folder for the CSV files of the "bulk_insert" method. Must be readable by SQL
+                                      server, or be a path inside insert_data_source.
+    :param insert_data_source:        Name of an external data source (e.g. Azure blob storage) for "bulk_insert" files.
+    :return: fact_throw_ins:          Pandas dataframe of the throw-ins that were written. None if nothing changed.
+    """
+    # Start a new set of stage metrics, so that the summary only shows this run's stages.
+    func.start_stage_run()
+
+    # Incremental loads rely on SQL validity columns, so parquet datasets are always fully rewritten.
+    if storage_backend == "parquet" and load_mode == "incremental":
+        print("Incremental loads are only available for SQL storage. Running a full load.")
+        load_mode = "full"
+
+    # Settings for inserting rows into SQL server, shared by full and incremental loads.
+    insert_options = {"method": insert_method, "batch_size": insert_batch_size, "fast_executemany": fast_executemany,
+                      "staging_folder": insert_staging_folder, "data_source": insert_data_source}
+
+    # Throw-ins can only be extracted on the server for SQL storage.
+    sql_window_pushdown = sql_window_pushdown and storage_backend == "sql"
+
+    # Connect to SQL server using SQL alchemy. The same pooled engine is used for every read and write.
+    if storage_backend == "sql" and engine is None:
+        engine = func.get_sql_engine(config_path=sql_config_path, echo=sql_echo)
+
+    # The source changes that this load processes. The time is taken before anything is read, so rows that change while
+    # the load runs are picked up by the next load.
+    load_state = load_load_state(load_state_path=load_state_path)
+    if storage_backend == "sql":
+        run_start_time = get_sql_server_time(engine=engine)
+        source_game_ids = get_source_game_ids(engine=engine, source_tables=SOURCE_TABLES)
+
+    # Outputs that are loaded incrementally, and the file each is kept in. Each has its own load state, so an output that
+    # failed to update in an earlier run catches up on the games it missed.
+    target_paths = {"Fact.Throw_Ins": None}
+    if sequence_store_folder is not None:
+        target_paths["sequence_store"] = os.path.join(sequence_store_folder, func.SEQUENCE_STORE_FILES["table"])
+    if cube_folder is not None:
+        target_paths["cube"] = os.path.join(cube_folder, "cube.json")
+
+    # Record that an output has processed every game in the source at the start of the load.
+    def save_target_load_state(target):
+        if storage_backend == "sql":
+            load_state[target] = {"watermark": str(run_start_time), "game_ids": source_game_ids}
+            save_load_state(load_state=load_state, load_state_path=load_state_path)
+
+    # Find games that are new or have changed since each output was last loaded. Outputs that have been deleted are
+    # rebuilt from every game.
+    changed_game_ids = None
+    if load_mode == "incremental":
+        target_states = {target: load_state.get(target) if path is None or os.path.exists(path) else
+                         {"watermark": None, "game_ids": []}
+                         for target, path in target_paths.items()}
+        changed_game_ids = get_changed_game_ids(engine=engine, source_tables=SOURCE_TABLES,
+                                                target_schema="Fact", target_name="Throw_Ins",
+                                                target_states=target_states, source_game_ids=source_game_ids)
+
+        # Fall back to a full load if Fact.Throw_Ins doesn't exist yet.
+        if changed_game_ids is None:
+            load_mode = "full"
+
+        # Nothing to do if no games have changed.
+        elif len(changed_game_ids) == 0:
+            for target in target_paths:
+                save_target_load_state(target)
+            func.remove_checkpoints(checkpoint_folder=checkpoint_folder, stage_names=CHECKPOINT_STAGES)
+            print("Fact.Throw_Ins is already up to date.")
+            return None
+
+    # Checkpoints made by different code, or from different source data or settings, are never resumed from.
+    code_version = func.get_code_version(paths=[func.__file__, __file__])
+    load_key_parts = {"code_version": code_version, "storage_backend": storage_backend, "load_mode": load_mode,
+                      "changed_game_ids": changed_game_ids, "sql_window_pushdown": sql_window_pushdown,
+                      "sql_skip_useless_columns": sql_skip_useless_columns,
+                      "source_tables": get_source_tables_state(engine=engine, storage_backend=storage_backend,
+                                                               parquet_folder=parquet_folder)}
+
+    # Load SB and Opta throw-ins from SQL server or parquet, and store them with compact datatypes straight away so that
+    # the wide dataframes are released before the transforms. Default values are kept, so every stage gives the same
+    # results, and the throw-ins are converted back to SQL datatypes when they are written.
+    def load_stage():
+        sb_throw_ins, opta_throw_ins = load_source_throw_ins(engine=engine, storage_backend=storage_backend,
+                                                             load_mode=load_mode, changed_game_ids=changed_game_ids,
+                                                             parquet_folder=parquet_folder,
+                                                             sql_window_pushdown=sql_window_pushdown,
+                                                             sql_skip_useless_columns=sql_skip_useless_columns)
+        sb_throw_ins = func.optimise_dtypes(df=sb_throw_ins, guid_columns=GUID_COLUMNS, keep_default_values=True)
+        opta_throw_ins = func.optimise_dtypes(df=opta_throw_ins, guid_columns=GUID_COLUMNS, keep_default_values=True)
+        return {"sb_throw_ins": sb_throw_ins, "opta_throw_ins": opta_throw_ins}
+
+    outputs, checkpoint_key = func.run_checkpointed_stage("load", key_parts=load_key_parts, stage_function=load_stage,
+                                                          checkpoint_folder=checkpoint_folder,
+                                                          metrics_path=stage_metrics_path)
+
+    # Drop columns containing no data.
+    def drop_useless_columns_stage():
+        return {name: func.drop_useless_columns(df=throw_ins_df) for name, throw_ins_df in outputs.items()}
+
+    outputs, checkpoint_key = func.run_checkpointed_stage("drop_useless_columns", key_parts=[checkpoint_key],
+                                                          stage_function=drop_useless_columns_stage,
+                                                          checkpoint_folder=checkpoint_folder,
+                                                          metrics_path=stage_metrics_path)
+
+    # Extract all throw-in events and the event preceding them, and add column showing how far a player gained on a throw.
+    def transform_throw_ins_stage():
+        fact_sb_throw_ins, fact_opta_throw_ins = outputs["sb_throw_ins"], outputs["opta_throw_ins"]
+
+        # Throw-ins and the event before them were already extracted on SQL server, in order of game and event index.
+        if sql_window_pushdown:
+            fact_sb_throw_ins = func.add_throw_in_column(throw_ins_df=fact_sb_throw_ins, data_source="Statsbomb")
+            fact_opta_throw_ins = func.add_throw_in_column(throw_ins_df=fact_opta_throw_ins, data_source="Opta")
+
+        # Games are independent, so they can be split between worker processes.
+        elif parallel_workers > 1:
+            fact_sb_throw_ins = func.transform_throw_ins_in_parallel(throw_ins_df=fact_sb_throw_ins,
+                                                                     data_source="Statsbomb", max_workers=parallel_workers)
+            fact_opta_throw_ins = func.transform_throw_ins_in_parallel(throw_ins_df=fact_opta_throw_ins,
+                                                                       data_source="Opta", max_workers=parallel_workers)
+
+        else:
+            fact_sb_throw_ins = func.extract_throw_ins_and_preceding_event(throw_ins_df=fact_sb_throw_ins,
+                                                                           data_source="Statsbomb")
+            fact_opta_throw_ins = func.extract_throw_ins_and_preceding_event(throw_ins_df=fact_opta_throw_ins,
+                                                                             data_source="Opta")
+
+            fact_sb_throw_ins = func.add_throw_in_column(throw_ins_df=fact_sb_throw_ins, data_source="Statsbomb")
+            fact_opta_throw_ins = func.add_throw_in_column(throw_ins_df=fact_opta_throw_ins, data_source="Opta")
+
+        return {"sb_throw_ins": fact_sb_throw_ins, "opta_throw_ins": fact_opta_throw_ins}
+
+    outputs, checkpoint_key = func.run_checkpointed_stage("transform_throw_ins", key_parts=[checkpoint_key],
+                                                          stage_function=transform_throw_ins_stage,
+                                                          checkpoint_folder=checkpoint_folder,
+                                                          metrics_path=stage_metrics_path)
+
+    # Merge the Opta and SB throw-ins into one dataframe.
+    def merge_stage():
+        return {"throw_ins": func.merge_sb_and_opta_throw_ins(sb_throw_ins=outputs["sb_throw_ins"],
+                                                              opta_throw_ins=outputs["opta_throw_ins"],
+                                                              guid_columns=GUID_COLUMNS)}
+
+    outputs, checkpoint_key = func.run_checkpointed_stage("merge", key_parts=[checkpoint_key], stage_function=merge_stage,
+                                                          checkpoint_folder=checkpoint_folder,
+                                                          metrics_path=stage_metrics_path)
+
+    # Write the throw-ins to parquet, create the table in SQL, or merge the changed games into the existing SQL table.
+    # The sequence store and aggregates below are built from the same SQL datatypes, whichever backend is used. The
+    # compact dataframe is released once it has been converted.
+    with func.track_stage("write", metrics_path=stage_metrics_path) as stage:
+        fact_throw_ins = func.restore_sql_dtypes(df=outputs.pop("throw_ins"), guid_columns=GUID_COLUMNS)
+        if storage_backend == "parquet":
+            func.write_parquet_table(df=fact_throw_ins, dataset_folder=parquet_folder, table_schema="Fact",
+                                     table_name="Throw_Ins",
+                                     partition_columns=[column for column in parquet_partition_columns
+                                                        if column in fact_throw_ins.columns])
+
+        elif load_mode == "full":
+            create_throw_ins_table_in_sql(engine=engine, table_schema="Fact", table_name="Throw_Ins",
+                                          throw_ins_df=fact_throw_ins, guid_columns=GUID_COLUMNS,
+                                          registry_path=schema_registry_path, sb_event_schema_path=sb_event_schema_path,
+                                          insert_options=insert_options)
+
+        else:
+            merge_throw_ins_into_sql_table(engine=engine, table_schema="Fact", table_name="Throw_Ins",
+                                           throw_ins_df=fact_throw_ins, changed_game_ids=changed_game_ids,
+                                           guid_columns=GUID_COLUMNS, registry_path=schema_registry_path,
+                                           insert_options=insert_options)
+
+        save_target_load_state("Fact.Throw_Ins")
+        stage["rows"] = len(fact_throw_ins)
+
+    # Write the game indexed store that analysts look up single games, teams and players in.
+    if sequence_store_folder is not None:
+        with func.track_stage("sequence_store", metrics_path=stage_metrics_path) as stage:
+            rebuild = load_mode == "full" or not os.path.exists(target_paths["sequence_store"])
+            func.write_throw_in_sequence_store(throw_ins_df=fact_throw_ins, store_folder=sequence_store_folder,
+                                               replace_game_ids=None if rebuild else changed_game_ids)
+            save_target_load_state("sequence_store")
+            stage["rows"] = len(fact_throw_ins)
+
+    # Update the aggregates that dashboards query instead of the fact table. Only the changed games are replaced.
+    if cube_folder is not None:
+        with func.track_stage("aggregates", metrics_path=stage_metrics_path) as stage:
+            rebuild = load_mode == "full" or not os.path.exists(target_paths["cube"])
+            func.update_metres_stolen_cube(throw_ins_df=fact_throw_ins, cube_folder=cube_folder,
+                                           replace_game_ids=None if rebuild else changed_game_ids)
+            save_target_load_state("cube")
+            stage["rows"] = len(fact_throw_ins)
+
+    # Every stage finished, so the next run starts from the new source data rather than these checkpoints.
+    func.remove_checkpoints(checkpoint_folder=checkpoint_folder, stage_names=CHECKPOINT_STAGES)
+
+    # Summary of the time, CPU time, memory and row count of each stage.
+    func.print_stage_summary()
+
+    return fact_throw_ins
+
+
+#%% Command line entry point, e.g. python Throw_Ins_Pipeline.py --load-mode full --sql-config sql_config.json
+
+def main(argv=None):
+    """
+    :param argv: List of command line arguments. sys.argv is used if None.
+    :return:     Runs the pipeline with the settings from the command line.
+    """
+    parser = argparse.ArgumentParser(description="Load Fact.Throw_Ins from the SB and Opta throw-ins.")
+    parser.add_argument("--load-mode", choices=["full", "incremental"], default="incremental")
+    parser.add_argument("--storage-backend", choices=["sql", "parquet"], default="sql")
+    parser.add_argument("--sql-config", default=None,
+                        help="JSON file with server, database and username. Environment variables override it.")
+    parser.add_argument("--sql-echo", action="store_true", help="Log every SQL statement sent to the server.")
+    parser.add_argument("--sql-window-pushdown", action="store_true",
+                        help="Extract throw-ins and the event before them on SQL server, so fewer rows are downloaded.")
+    parser.add_argument("--sql-skip-useless-columns", action="store_true",
+                        help="Don't download columns that only contain default values.")
+    parser.add_argument("--schema-registry", default="Fact.Throw_Ins.schema.json")
+    parser.add_argument("--load-state", default="Fact.Throw_Ins.load_state.json",
+                        help="JSON file with the start time of the last load and the games it processed.")
+    parser.add_argument("--sb-event-schema", default=None,
+                        help="JSON file from func.SB_profile_event_schema, used to size the SB string columns.")
+    parser.add_argument("--sequence-store", default="throw_ins_store",
+                        help="Folder for the game indexed store of throw-ins. Pass an empty string to not write it.")
+    parser.add_argument("--cube", default="throw_ins_cube",
+                        help="Folder for the metres gained aggregates. Pass an empty string to not keep them.")
+    parser.add_argument("--parquet-folder", default="data")
+    parser.add_argument("--parallel-workers", type=int, default=1)
+    parser.add_argument("--stage-metrics", default="stage_metrics.jsonl",
+                        help="JSON lines file that stage metrics are added to. Pass an empty string to not write them.")
+    parser.add_argument("--checkpoints", default="checkpoints",
+                        help="Folder for stage checkpoints, so a failed run can be resumed. Pass an empty string to not "
+                             "save them.")
+    parser.add_argument("--insert-method", choices=["executemany", "values", "bulk_insert"], default="executemany",
+                        help="How rows are inserted into SQL server.")
+    parser.add_argument("--insert-batch-size", type=int, default=50000,
+                        help="Maximum number of rows sent to SQL server in each batch.")
+    parser.add_argument("--fast-executemany", action=argparse.BooleanOptionalAction, default=None,
+                        help="Send each executemany batch as one array of parameters. The engine's setting is used if "
+                             "neither flag is passed.")
+    parser.add_argument("--insert-staging-folder", default=None,
+                        help="Folder for the CSV files of the bulk_insert method. Must be readable by SQL server.")
+    parser.add_argument("--insert-data-source", default=None,
+                        help="External data source (e.g. Azure blob storage) for the bulk_insert files.")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(message)s")
+
+    run_throw_ins_pipeline(load_mode=args.load_mode, storage_backend=args.storage_backend,
+                           sql_config_path=args.sql_config, sql_echo=args.sql_echo,
+                           sql_window_pushdown=args.sql_window_pushdown,
+                           sql_skip_useless_columns=args.sql_skip_useless_columns,
+                           schema_registry_path=args.schema_registry, load_state_path=args.load_state,
+                           sb_event_schema_path=args.sb_event_schema,
+                           sequence_store_folder=args.sequence_store or None,
+                           cube_folder=args.cube or None,
+                           parquet_folder=args.parquet_folder, parallel_workers=args.parallel_workers,
+                           stage_metrics_path=args.stage_metrics or None,
+                           checkpoint_folder=args.checkpoints or None,
+                           insert_method=args.insert_method, insert_batch_size=args.insert_batch_size,
+                           fast_executemany=args.fast_executemany, insert_staging_folder=args.insert_staging_folder,
+                           insert_data_source=args.insert_data_source)
+
+
+# Only run when called as a script, so that importing this module (or starting worker processes) doesn't run a load.
+if __name__ == "__main__":
+    main(sys.argv[1:])